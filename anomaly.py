@@ -0,0 +1,41 @@
+"""Streaming outlier detection for sales quantities.
+
+Every recipe keeps three numbers: how many sales it has seen, and the running
+mean and variance of their quantities. Each new sale updates them in O(1)
+without looking at the history again. The first sales are combined with
+Welford's method, so they all count equally. After that the weights decay
+exponentially (EWMA), so the statistics follow slow changes in demand.
+"""
+import math
+
+# Weight of the newest sale once warmed up (roughly the last 1 / ALPHA sales count)
+ALPHA = 0.05
+# No sale is flagged until its recipe has this many sales
+MIN_SAMPLES = 10
+# A sale is an outlier when it is more than this many standard deviations from the mean
+Z_THRESHOLD = 4.0
+# The standard deviation is never taken below this fraction of the mean, so a
+# recipe that always sells 1 isn't flagged the first time it sells 2
+MIN_STD_FRACTION = 0.25
+
+
+def update(count, mean, variance, quantity):
+    """Folds one sale into a recipe's statistics; returns (count, mean, variance, flagged).
+
+    Outliers are clipped to the flagging limit before they are folded in. A
+    single typo (50 instead of 5) then barely moves the statistics, but a
+    real, lasting jump in demand still pulls the mean up over a few dozen sales.
+    """
+    flagged = False
+    if count >= MIN_SAMPLES:
+        limit = Z_THRESHOLD * max(math.sqrt(variance), MIN_STD_FRACTION * abs(mean))
+        if abs(quantity - mean) > limit:
+            flagged = True
+            quantity = mean + math.copysign(limit, quantity - mean)
+
+    count += 1
+    alpha = max(1 / count, ALPHA)  # 1 / count is Welford's running (population) variance
+    diff = quantity - mean
+    mean += alpha * diff
+    variance = (1 - alpha) * (variance + alpha * diff * diff)
+    return count, mean, variance, flagged
@@ -0,0 +1,211 @@
+"""In-memory snapshot of ingredients and recipes shared by every tab and engine.
+
+Ingredient quantities, costs and thresholds are contiguous NumPy arrays
+indexed by position, with dicts mapping ids to positions. Recipe lines are
+stored CSR-style: the lines of the recipe at position r are
+line_ingredients[line_offsets[r]:line_offsets[r + 1]] (ingredient positions)
+with the matching line_quantities. Recipe costs for the whole menu are then a
+single weighted bincount instead of a join per refresh.
+
+FoodDatabase builds the snapshot on first use and patches it in place after
+each of its own writes. Changes made by other instances are found by
+comparing ingredient row versions and recipe names with the tables, and only
+those rows are re-read.
+"""
+from itertools import chain
+
+import numpy as np
+
+
+def positions(ids, wanted):
+    """Returns the position of each wanted id in the ids array, or -1 where it is missing."""
+    if not len(ids):
+        return np.full(len(wanted), -1, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    found = order[np.minimum(np.searchsorted(ids, wanted, sorter=order), len(ids) - 1)]
+    return np.where(ids[found] == wanted, found, -1)
+
+
+class Catalog:
+    """Ingredients, recipes and recipe lines as arrays; see the module docstring for the layout."""
+
+    def __init__(self, ingredients, recipes, lines):
+        """ingredients are Ingredient records, recipes (id, name) pairs and lines
+        (recipe_id, ingredient_id, quantity_required) rows."""
+        self.ingredient_ids = np.array([ingredient.id for ingredient in ingredients], dtype=np.int64)
+        self.ingredient_names = [ingredient.name for ingredient in ingredients]
+        self.units = [ingredient.unit for ingredient in ingredients]
+        self.quantities = np.array([ingredient.quantity for ingredient in ingredients], dtype=float)
+        self.costs = np.array([ingredient.cost_per_unit for ingredient in ingredients], dtype=float)
+        self.thresholds = np.array([ingredient.threshold for ingredient in ingredients], dtype=float)
+        self.ingredient_versions = np.array([ingredient.version for ingredient in ingredients], dtype=np.int64)
+
+        self.recipe_ids = np.array([recipe_id for recipe_id, _ in recipes], dtype=np.int64)
+        self.recipe_names = [name for _, name in recipes]
+        self._reindex()
+        self._set_lines(*self._resolve_lines(lines))
+
+    @classmethod
+    def load(cls, db):
+        # In id order, so rows added later by patches keep the order a fresh load would give
+        return cls(sorted(db.ingredients.all()), sorted(db.recipes.names()), db.recipes.all_lines())
+
+    def _reindex(self):
+        self.ingredient_index = {ingredient_id: i for i, ingredient_id in enumerate(self.ingredient_ids.tolist())}
+        self.recipe_index = {recipe_id: i for i, recipe_id in enumerate(self.recipe_ids.tolist())}
+        self._recipe_costs = None
+
+    def _resolve_lines(self, lines):
+        """Turns (recipe_id, ingredient_id, quantity) rows into position arrays, dropping unknown ids."""
+        table = np.array(lines, dtype=float).reshape(-1, 3)
+        rows = positions(self.recipe_ids, table[:, 0].astype(np.int64))
+        cols = positions(self.ingredient_ids, table[:, 1].astype(np.int64))
+        known = (rows >= 0) & (cols >= 0)
+        return rows[known], cols[known], table[known, 2]
+
+    def changed_ingredients(self, versions):
+        """Returns the ids of ingredients added, edited or removed, given every (id, version) in the table."""
+        table = np.fromiter(chain.from_iterable(versions), np.int64, 2 * len(versions)).reshape(-1, 2)
+        at = positions(self.ingredient_ids, table[:, 0])
+        known = at >= 0
+        changed = ~known
+        changed[known] = self.ingredient_versions[at[known]] != table[known, 1]
+        removed = positions(table[:, 0], self.ingredient_ids) < 0
+        return table[changed, 0].tolist() + self.ingredient_ids[removed].tolist()
+
+    def changed_recipes(self, recipes):
+        """Returns the ids of recipes added, renamed or removed, given every (id, name) in the table."""
+        changed = [recipe_id for recipe_id, name in recipes
+                   if recipe_id not in self.recipe_index or self.recipe_names[self.recipe_index[recipe_id]] != name]
+        current = {recipe_id for recipe_id, _ in recipes}
+        return changed + [recipe_id for recipe_id in self.recipe_index if recipe_id not in current]
+
+    def line_recipes(self):
+        """Recipe position of every line (the CSR row indices expanded)."""
+        return np.repeat(np.arange(len(self.recipe_ids)), np.diff(self.line_offsets))
+
+    def _set_lines(self, rows, cols, quantities):
+        """Stores lines given as parallel (row, col, quantity) arrays in CSR order."""
+        order = np.argsort(rows, kind="stable")
+        self.line_ingredients = cols[order]
+        self.line_quantities = quantities[order]
+        self.line_offsets = np.zeros(len(self.recipe_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.recipe_ids)), out=self.line_offsets[1:])
+        self._recipe_costs = None
+
+    def ingredient_rows(self):
+        """Returns (id, name, quantity, unit, cost_per_unit, threshold) tuples for the ingredients table."""
+        return list(zip(self.ingredient_ids.tolist(), self.ingredient_names, self.quantities.tolist(),
+                        self.units, self.costs.tolist(), self.thresholds.tolist()))
+
+    def ingredient_choices(self):
+        """Returns [(id, name), ...] for filling pickers."""
+        return list(zip(self.ingredient_ids.tolist(), self.ingredient_names))
+
+    def recipe_choices(self):
+        """Returns [(id, name), ...] for filling pickers."""
+        return list(zip(self.recipe_ids.tolist(), self.recipe_names))
+
+    def recipe_costs(self):
+        """Cost of every recipe in recipe_ids order, rounded to cents; recomputed only after a patch."""
+        if self._recipe_costs is None:
+            line_costs = self.line_quantities * self.costs[self.line_ingredients]
+            self._recipe_costs = np.round(
+                np.bincount(self.line_recipes(), weights=line_costs, minlength=len(self.recipe_ids)), 2)
+        return self._recipe_costs
+
+    def recipe_cost(self, recipe_id):
+        row = self.recipe_index.get(recipe_id)
+        return 0 if row is None else float(self.recipe_costs()[row])
+
+    def set_ingredients(self, ingredients):
+        """Patches changed Ingredient records in place and appends new ones."""
+        new = []
+        for ingredient in ingredients:
+            i = self.ingredient_index.get(ingredient.id)
+            if i is None:
+                new.append(ingredient)
+                continue
+            self.ingredient_names[i] = ingredient.name
+            self.units[i] = ingredient.unit
+            self.quantities[i] = ingredient.quantity
+            self.costs[i] = ingredient.cost_per_unit
+            self.thresholds[i] = ingredient.threshold
+            self.ingredient_versions[i] = ingredient.version
+        if new:
+            self.ingredient_ids = np.concatenate([self.ingredient_ids, [ingredient.id for ingredient in new]])
+            self.ingredient_names.extend(ingredient.name for ingredient in new)
+            self.units.extend(ingredient.unit for ingredient in new)
+            self.quantities = np.concatenate([self.quantities, [ingredient.quantity for ingredient in new]])
+            self.costs = np.concatenate([self.costs, [ingredient.cost_per_unit for ingredient in new]])
+            self.thresholds = np.concatenate([self.thresholds, [ingredient.threshold for ingredient in new]])
+            self.ingredient_versions = np.concatenate([self.ingredient_versions,
+                                                       [ingredient.version for ingredient in new]])
+            self._reindex()
+        self._recipe_costs = None
+
+    def remove_ingredients(self, ingredient_ids):
+        """Drops ingredients and every recipe line that uses them."""
+        positions = [self.ingredient_index[i] for i in ingredient_ids if i in self.ingredient_index]
+        if not positions:
+            return
+        keep = np.ones(len(self.ingredient_ids), dtype=bool)
+        keep[positions] = False
+        new_position = np.cumsum(keep) - 1
+        self.ingredient_ids = self.ingredient_ids[keep]
+        self.ingredient_names = [name for name, kept in zip(self.ingredient_names, keep) if kept]
+        self.units = [unit for unit, kept in zip(self.units, keep) if kept]
+        self.quantities = self.quantities[keep]
+        self.costs = self.costs[keep]
+        self.thresholds = self.thresholds[keep]
+        self.ingredient_versions = self.ingredient_versions[keep]
+        self._reindex()
+
+        kept_lines = keep[self.line_ingredients]
+        self._set_lines(self.line_recipes()[kept_lines], new_position[self.line_ingredients[kept_lines]],
+                        self.line_quantities[kept_lines])
+
+    def set_lines(self, lines):
+        """Replaces every recipe line with the given (recipe_id, ingredient_id, quantity) rows."""
+        self._set_lines(*self._resolve_lines(lines))
+
+    def set_recipes(self, recipes, lines):
+        """Patches or appends (id, name) recipes and replaces their lines with
+        the given (recipe_id, ingredient_id, quantity) rows."""
+        new = []
+        for recipe_id, name in recipes:
+            row = self.recipe_index.get(recipe_id)
+            if row is None:
+                new.append((recipe_id, name))
+            else:
+                self.recipe_names[row] = name
+        if new:
+            self.recipe_ids = np.concatenate([self.recipe_ids, [recipe_id for recipe_id, _ in new]])
+            self.recipe_names.extend(name for _, name in new)
+            self._reindex()
+            # The new recipes have no lines yet
+            self.line_offsets = np.concatenate(
+                [self.line_offsets, np.full(len(new), self.line_offsets[-1], dtype=np.int64)])
+
+        rows = self.line_recipes()
+        kept_lines = ~np.isin(rows, [self.recipe_index[recipe_id] for recipe_id, _ in recipes])
+        new_rows, new_cols, new_quantities = self._resolve_lines(lines)
+        self._set_lines(np.concatenate([rows[kept_lines], new_rows]),
+                        np.concatenate([self.line_ingredients[kept_lines], new_cols]),
+                        np.concatenate([self.line_quantities[kept_lines], new_quantities]))
+
+    def remove_recipes(self, recipe_ids):
+        """Drops recipes and their lines."""
+        positions = [self.recipe_index[i] for i in recipe_ids if i in self.recipe_index]
+        if not positions:
+            return
+        keep = np.ones(len(self.recipe_ids), dtype=bool)
+        keep[positions] = False
+        new_position = np.cumsum(keep) - 1
+        rows = self.line_recipes()
+        kept_lines = keep[rows]
+        self.recipe_ids = self.recipe_ids[keep]
+        self.recipe_names = [name for name, kept in zip(self.recipe_names, keep) if kept]
+        self._reindex()
+        self._set_lines(new_position[rows[kept_lines]], self.line_ingredients[kept_lines],
+                        self.line_quantities[kept_lines])
@@ -0,0 +1,747 @@
+"""Creates the food business database and applies schema migrations.
+
+Run directly to create/upgrade food_business.db:
+
+    python db_setup.py
+
+or to compare the legacy and compact SalesHistory layouts on synthetic data:
+
+    python db_setup.py --report --rows 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import anomaly
+
+DB_PATH = "food_business.db"
+
+# WAL lets readers keep working while another instance writes. It relies on
+# shared memory, so every process must run on the machine that holds the file;
+# use "delete" if the database lives on a network share.
+JOURNAL_MODE = "wal"
+BUSY_TIMEOUT_SECONDS = 5.0
+
+# QDate.toJulianDay() and SQLite's julianday() + 0.5 both count days from the
+# same epoch, so day numbers written by the GUI and by SQL always agree.
+JULIAN_DAY_OFFSET = 1721425
+
+
+def date_to_day(value):
+    """Converts a datetime.date to the integer day number stored in SalesHistory."""
+    return value.toordinal() + JULIAN_DAY_OFFSET
+
+
+def day_to_date(day):
+    """Converts a stored integer day number back to a datetime.date."""
+    return datetime.date.fromordinal(day - JULIAN_DAY_OFFSET)
+
+
+# The database's own location always has this id. Other locations only
+# appear in a central database that their changesets are applied to.
+LOCAL_LOCATION_ID = 1
+DEFAULT_LOCATION_NAME = "Main"
+
+# Change streams recorded in RowChanges for replication (see sync.py):
+# stream -> (table, key of a row at every site, columns whose changes are
+# recorded, condition for rows to record). Catalog rows are keyed by uid
+# rather than id, because ids differ between sites, or name, which a
+# rename changes.
+CHANGE_STREAMS = {
+    "Ingredients": ("Ingredients", "json_array({row}.uid)", ("name", "unit", "cost_per_unit", "threshold"), None),
+    "Recipes": ("Recipes", "json_array({row}.uid)", ("name", "description"), None),
+    "RecipeIngredients": ("RecipeIngredients",
+                          "json_array((SELECT uid FROM Recipes WHERE id = {row}.recipe_id), "
+                          "(SELECT uid FROM Ingredients WHERE id = {row}.ingredient_id))",
+                          ("recipe_id", "ingredient_id", "quantity_required"), None),
+    "SalesHistory": ("SalesHistory", "json_array({row}.recipe_id, {row}.sale_day, {row}.id)",
+                     ("quantity_sold", "flagged"), f"{{row}}.location_id = {LOCAL_LOCATION_ID}"),
+}
+# Sales are append-only with increasing ids, so new sales are exported by id
+# and only edits of existing sales go through RowChanges. This keeps the
+# change log off the hot path of recording a sale.
+UPDATE_ONLY_STREAMS = ("SalesHistory",)
+# Catalog keys before migrate_replicated_ids(); migrate_locations() runs
+# before uids exist, so it keys its change log and triggers by name.
+NAME_KEYS = {
+    "Ingredients": "json_array({row}.name)",
+    "Recipes": "json_array({row}.name)",
+    "RecipeIngredients": "json_array((SELECT name FROM Recipes WHERE id = {row}.recipe_id), "
+                         "(SELECT name FROM Ingredients WHERE id = {row}.ingredient_id))",
+}
+
+# Expiry day stored for lots that don't expire, so they sort after every real
+# expiry date in the (ingredient_id, expiry_day) index.
+NO_EXPIRY_DAY = date_to_day(datetime.date.max)
+
+
+def create_tables(conn):
+    """Creates the original tables if they don't exist yet."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS Ingredients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            quantity REAL NOT NULL,
+            unit TEXT NOT NULL,
+            cost_per_unit REAL NOT NULL,
+            threshold REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS Recipes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT
+        );
+        CREATE TABLE IF NOT EXISTS RecipeIngredients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER NOT NULL,
+            ingredient_id INTEGER NOT NULL,
+            quantity_required REAL NOT NULL,
+            FOREIGN KEY (recipe_id) REFERENCES Recipes(id),
+            FOREIGN KEY (ingredient_id) REFERENCES Ingredients(id)
+        );
+        CREATE TABLE IF NOT EXISTS SalesHistory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            recipe_id INTEGER NOT NULL,
+            quantity_sold INTEGER NOT NULL,
+            FOREIGN KEY (recipe_id) REFERENCES Recipes(id)
+        );
+    """)
+
+
+def migrate_compact_sales_history(conn):
+    """Rebuilds SalesHistory with integer day numbers, clustered on (recipe_id, sale_day, id).
+
+    WITHOUT ROWID stores the rows inside the primary key b-tree, so the
+    per-recipe date range scans used for demand prediction read one
+    contiguous run of pages and never touch a separate index.
+    """
+    conn.execute("""
+        CREATE TABLE SalesHistory_compact (
+            recipe_id INTEGER NOT NULL,
+            sale_day INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            quantity_sold REAL NOT NULL,
+            PRIMARY KEY (recipe_id, sale_day, id),
+            FOREIGN KEY (recipe_id) REFERENCES Recipes(id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO SalesHistory_compact (recipe_id, sale_day, id, quantity_sold)
+        SELECT recipe_id, CAST(julianday(sale_date) + 0.5 AS INTEGER), id, CAST(quantity_sold AS REAL)
+        FROM SalesHistory
+        WHERE julianday(sale_date) IS NOT NULL
+    """)
+    conn.execute("DROP TABLE SalesHistory")
+    conn.execute("ALTER TABLE SalesHistory_compact RENAME TO SalesHistory")
+
+    # id is no longer a rowid, so new ids come from a counter instead of
+    # MAX(id), which would need a full scan or an extra index.
+    conn.execute("CREATE TABLE Sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("""
+        INSERT INTO Sequences (name, value)
+        SELECT 'SalesHistory', IFNULL(MAX(id), 0) FROM SalesHistory
+    """)
+
+
+def migrate_row_versions(conn):
+    """Adds row versions for optimistic concurrency and per-table change counters.
+
+    Ingredients and Recipes get a version column that every update bumps, so
+    a save based on stale data can be detected instead of silently
+    overwriting another instance's edit. TableVersions is bumped by triggers
+    on every write and tells a watcher which tables another connection changed.
+    """
+    conn.execute("ALTER TABLE Ingredients ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    conn.execute("ALTER TABLE Recipes ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    conn.execute("CREATE TABLE TableVersions (name TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID")
+    for table in ("Ingredients", "Recipes", "RecipeIngredients", "SalesHistory"):
+        track_table_version(conn, table)
+
+
+def track_table_version(conn, table):
+    """Adds a TableVersions counter for `table` and the triggers that bump it on every write."""
+    conn.execute("INSERT INTO TableVersions (name, version) VALUES (?, 0)", (table,))
+    create_version_triggers(conn, table)
+
+
+def create_version_triggers(conn, table):
+    for operation in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER trg_{table}_{operation.lower()}_version AFTER {operation} ON {table}
+            BEGIN
+                UPDATE TableVersions SET version = version + 1 WHERE name = '{table}';
+            END
+        """)
+
+
+def migrate_unique_recipe_lines(conn):
+    """Makes (recipe_id, ingredient_id) unique in RecipeIngredients so recipe saves can UPSERT lines."""
+    # Keep only the newest line if an ingredient was ever added twice to a recipe
+    conn.execute("""
+        DELETE FROM RecipeIngredients
+        WHERE id NOT IN (SELECT MAX(id) FROM RecipeIngredients GROUP BY recipe_id, ingredient_id)
+    """)
+    conn.execute("CREATE UNIQUE INDEX idx_recipe_ingredients_recipe_ingredient "
+                 "ON RecipeIngredients(recipe_id, ingredient_id)")
+
+
+def migrate_inventory_lots(conn):
+    """Adds lot-level stock with received and expiry days.
+
+    Ingredients.quantity stays the total on hand; InventoryLots breaks it down
+    so sales can consume the oldest or soonest-expiring stock first. The
+    partial indexes only contain open lots (quantity_remaining > 0), so they
+    stay small however many lots have been used up. Existing stock becomes one
+    opening lot per ingredient with no expiry.
+    """
+    conn.execute("""
+        CREATE TABLE InventoryLots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ingredient_id INTEGER NOT NULL,
+            received_day INTEGER NOT NULL,
+            expiry_day INTEGER NOT NULL,
+            quantity_received REAL NOT NULL,
+            quantity_remaining REAL NOT NULL,
+            FOREIGN KEY (ingredient_id) REFERENCES Ingredients(id)
+        )
+    """)
+    conn.execute("CREATE INDEX idx_lots_fefo ON InventoryLots(ingredient_id, expiry_day, id) "
+                 "WHERE quantity_remaining > 0")
+    conn.execute("CREATE INDEX idx_lots_fifo ON InventoryLots(ingredient_id, received_day, id) "
+                 "WHERE quantity_remaining > 0")
+    conn.execute("CREATE INDEX idx_lots_expiry ON InventoryLots(expiry_day) WHERE quantity_remaining > 0")
+    conn.execute("""
+        INSERT INTO InventoryLots (ingredient_id, received_day, expiry_day, quantity_received, quantity_remaining)
+        SELECT id, ?, ?, quantity, quantity FROM Ingredients WHERE quantity > 0
+    """, (date_to_day(datetime.date.today()), NO_EXPIRY_DAY))
+    track_table_version(conn, "InventoryLots")
+
+
+def migrate_sale_anomaly_stats(conn):
+    """Adds SalesHistory.flagged and the per-recipe running statistics behind it.
+
+    SaleStats holds one row per recipe (see anomaly.update()); new sales update
+    it in O(1). This migration is the only time history is replayed: existing
+    sales are read once in primary-key order to seed the statistics and flag
+    past outliers.
+    """
+    conn.execute("ALTER TABLE SalesHistory ADD COLUMN flagged INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE SaleStats (
+            recipe_id INTEGER PRIMARY KEY,
+            sample_count INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            variance REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    stats = {}
+    flagged = []
+    for recipe_id, sale_day, sale_id, quantity_sold in conn.execute(
+            "SELECT recipe_id, sale_day, id, quantity_sold FROM SalesHistory ORDER BY recipe_id, sale_day, id"):
+        *stats[recipe_id], is_outlier = anomaly.update(*stats.get(recipe_id, (0, 0.0, 0.0)), quantity_sold)
+        if is_outlier:
+            flagged.append((recipe_id, sale_day, sale_id))
+    conn.executemany("INSERT INTO SaleStats (recipe_id, sample_count, mean, variance) VALUES (?, ?, ?, ?)",
+                     [(recipe_id, *state) for recipe_id, state in stats.items()])
+    conn.executemany("UPDATE SalesHistory SET flagged = 1 WHERE recipe_id = ? AND sale_day = ? AND id = ?", flagged)
+
+
+def migrate_locations(conn):
+    """Adds the location dimension and the change log used for replication.
+
+    SalesHistory is rebuilt with location_id in its primary key, because sale
+    ids are only unique within one site. New rows default to this
+    database's own location, so recording a sale doesn't change.
+    Locations.changeset is the number of the last changeset exported (for
+    this database's own location) or applied (for the others). LocationStock
+    holds the other locations' stock as of their last changeset (stock is
+    small, so each changeset carries all of it).
+
+    Triggers record every change in CHANGE_STREAMS in RowChanges under the
+    next change sequence number, which is MAX(seq) + 1 read from the seq
+    index. Each row is kept once, with only its latest sequence number, so
+    an export reads just the rows changed since the previous export.
+    Existing rows are recorded with sequence number 1 and changed_at 0,
+    meaning the time of the edit is unknown. Existing sales need no entry;
+    they are exported by id.
+    """
+    conn.execute("""
+        CREATE TABLE Locations (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            changeset INTEGER NOT NULL DEFAULT 0,
+            exported_seq INTEGER NOT NULL DEFAULT 0,
+            exported_sale_id INTEGER NOT NULL DEFAULT 0,
+            exported_stock_version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT INTO Locations (id, name) VALUES (?, ?)", (LOCAL_LOCATION_ID, DEFAULT_LOCATION_NAME))
+
+    conn.execute(f"""
+        CREATE TABLE SalesHistory_located (
+            recipe_id INTEGER NOT NULL,
+            sale_day INTEGER NOT NULL,
+            location_id INTEGER NOT NULL DEFAULT {LOCAL_LOCATION_ID},
+            id INTEGER NOT NULL,
+            quantity_sold REAL NOT NULL,
+            flagged INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (recipe_id, sale_day, location_id, id),
+            FOREIGN KEY (recipe_id) REFERENCES Recipes(id),
+            FOREIGN KEY (location_id) REFERENCES Locations(id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO SalesHistory_located (recipe_id, sale_day, id, quantity_sold, flagged)
+        SELECT recipe_id, sale_day, id, quantity_sold, flagged FROM SalesHistory
+    """)
+    conn.execute("DROP TABLE SalesHistory")
+    conn.execute("ALTER TABLE SalesHistory_located RENAME TO SalesHistory")
+    create_version_triggers(conn, "SalesHistory")
+
+    conn.execute("""
+        CREATE TABLE LocationStock (
+            location_id INTEGER NOT NULL,
+            ingredient_id INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            PRIMARY KEY (location_id, ingredient_id),
+            FOREIGN KEY (location_id) REFERENCES Locations(id),
+            FOREIGN KEY (ingredient_id) REFERENCES Ingredients(id)
+        ) WITHOUT ROWID
+    """)
+
+    conn.execute("""
+        CREATE TABLE RowChanges (
+            stream TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            changed_at REAL NOT NULL,
+            PRIMARY KEY (stream, row_key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_row_changes_seq ON RowChanges(seq)")
+    for stream, (table, key, _, condition) in CHANGE_STREAMS.items():
+        key = NAME_KEYS.get(stream, key)
+        if stream not in UPDATE_ONLY_STREAMS:
+            conn.execute(f"""
+                INSERT INTO RowChanges (stream, row_key, seq, changed_at)
+                SELECT DISTINCT '{stream}', {key.format(row="r")}, 1, 0 FROM {table} r
+                WHERE {condition.format(row="r") if condition else "true"}
+            """)
+        create_change_triggers(conn, stream, key)
+
+
+def create_change_triggers(conn, stream, key=None):
+    """Creates the triggers that record a stream's inserts, updates and deletes in RowChanges.
+
+    An update that changes a row's key (a recipe line moved to another
+    recipe or ingredient) is also recorded under the old key, so it is
+    exported as a delete plus an insert. key defaults to the stream's key in
+    CHANGE_STREAMS.
+    """
+    table, stream_key, columns, condition = CHANGE_STREAMS[stream]
+    key = key or stream_key
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in columns)
+    triggers = {
+        "insert": ("INSERT", "NEW", []),
+        "update": (f"UPDATE OF {', '.join(columns)}", "NEW", [f"({changed})"]),
+        "rekey": (f"UPDATE OF {', '.join(columns)}", "OLD",
+                  [f"{key.format(row='OLD')} IS NOT {key.format(row='NEW')}"]),
+        "delete": ("DELETE", "OLD", []),
+    }
+    for name, (event, row, when) in triggers.items():
+        if stream in UPDATE_ONLY_STREAMS and name != "update":
+            continue
+        if condition:
+            when = [condition.format(row=row)] + when
+        conn.execute(f"""
+            CREATE TRIGGER trg_{stream}_{name}_change AFTER {event} ON {table}
+            {"WHEN " + " AND ".join(when) if when else ""}
+            BEGIN
+                INSERT INTO RowChanges (stream, row_key, seq, changed_at)
+                VALUES ('{stream}', {key.format(row=row)},
+                        (SELECT IFNULL(MAX(seq), 0) + 1 FROM RowChanges), julianday('now'))
+                ON CONFLICT (stream, row_key) DO UPDATE SET seq = excluded.seq, changed_at = excluded.changed_at;
+            END
+        """)
+
+
+def migrate_sale_prices(conn):
+    """Adds SalesHistory.unit_price, the price each sale was made at.
+
+    Prices weren't recorded before, so existing sales get NULL and are left
+    out of price elasticity fits (see pricing.py). Fitting reads
+    DailySalePrices instead of the sales themselves: units sold and revenue
+    of priced, unflagged sales per recipe and day, kept current by triggers
+    on SalesHistory. That is one row per recipe and day however many sales
+    there were, and it covers every way sales are written (the app,
+    replicated changesets, outlier flag changes).
+    """
+    conn.execute("ALTER TABLE SalesHistory ADD COLUMN unit_price REAL")
+    conn.execute("""
+        CREATE TABLE DailySalePrices (
+            recipe_id INTEGER NOT NULL,
+            sale_day INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (recipe_id, sale_day)
+        ) WITHOUT ROWID
+    """)
+    create_sale_price_triggers(conn)
+
+
+def create_sale_price_triggers(conn):
+    """Keeps DailySalePrices in step with SalesHistory by adding NEW and subtracting OLD rows."""
+    add = """
+        INSERT INTO DailySalePrices (recipe_id, sale_day, quantity, revenue)
+        SELECT NEW.recipe_id, NEW.sale_day, NEW.quantity_sold, NEW.quantity_sold * NEW.unit_price
+        WHERE NEW.unit_price > 0 AND NOT NEW.flagged
+        ON CONFLICT (recipe_id, sale_day) DO UPDATE SET
+            quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue;
+    """
+    subtract = """
+        UPDATE DailySalePrices
+        SET quantity = quantity - OLD.quantity_sold, revenue = revenue - OLD.quantity_sold * OLD.unit_price
+        WHERE recipe_id = OLD.recipe_id AND sale_day = OLD.sale_day AND OLD.unit_price > 0 AND NOT OLD.flagged;
+        DELETE FROM DailySalePrices
+        WHERE recipe_id = OLD.recipe_id AND sale_day = OLD.sale_day AND quantity < 1e-9;
+    """
+    for operation, body in (("INSERT", add),
+                            ("UPDATE OF recipe_id, sale_day, quantity_sold, unit_price, flagged", subtract + add),
+                            ("DELETE", subtract)):
+        conn.execute(f"""
+            CREATE TRIGGER trg_SalesHistory_{operation.split()[0].lower()}_prices AFTER {operation} ON SalesHistory
+            BEGIN
+                {body}
+            END
+        """)
+
+
+def migrate_daily_sales(conn):
+    """Adds DailySales, the units sold and revenue per recipe and day that sales trends read.
+
+    Trends used to group every SalesHistory row by a computed bucket, which
+    takes seconds on millions of sales. DailySales holds one row per recipe
+    and day, kept current by triggers like DailySalePrices, so a trend reads
+    at most that many rows. Unlike DailySalePrices it counts every sale:
+    flagged ones too, and unpriced_quantity holds the units sold without a
+    recorded price.
+    """
+    conn.execute("""
+        CREATE TABLE DailySales (
+            recipe_id INTEGER NOT NULL,
+            sale_day INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            unpriced_quantity REAL NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (recipe_id, sale_day)
+        ) WITHOUT ROWID
+    """)
+    # Grouping in primary-key order needs no sort
+    conn.execute("""
+        INSERT INTO DailySales (recipe_id, sale_day, quantity, unpriced_quantity, revenue)
+        SELECT recipe_id, sale_day, SUM(quantity_sold),
+               TOTAL(CASE WHEN unit_price IS NULL THEN quantity_sold END), TOTAL(quantity_sold * unit_price)
+        FROM SalesHistory
+        GROUP BY recipe_id, sale_day
+    """)
+    create_daily_sales_triggers(conn)
+
+
+def create_daily_sales_triggers(conn):
+    """Keeps DailySales in step with SalesHistory by adding NEW and subtracting OLD rows."""
+    add = """
+        INSERT INTO DailySales (recipe_id, sale_day, quantity, unpriced_quantity, revenue)
+        VALUES (NEW.recipe_id, NEW.sale_day, NEW.quantity_sold,
+                CASE WHEN NEW.unit_price IS NULL THEN NEW.quantity_sold ELSE 0 END,
+                IFNULL(NEW.quantity_sold * NEW.unit_price, 0))
+        ON CONFLICT (recipe_id, sale_day) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            unpriced_quantity = unpriced_quantity + excluded.unpriced_quantity,
+            revenue = revenue + excluded.revenue;
+    """
+    subtract = """
+        UPDATE DailySales
+        SET quantity = quantity - OLD.quantity_sold,
+            unpriced_quantity = unpriced_quantity - CASE WHEN OLD.unit_price IS NULL THEN OLD.quantity_sold ELSE 0 END,
+            revenue = revenue - IFNULL(OLD.quantity_sold * OLD.unit_price, 0)
+        WHERE recipe_id = OLD.recipe_id AND sale_day = OLD.sale_day;
+        DELETE FROM DailySales
+        WHERE recipe_id = OLD.recipe_id AND sale_day = OLD.sale_day AND quantity < 1e-9;
+    """
+    for operation, body in (("INSERT", add),
+                            ("UPDATE OF recipe_id, sale_day, quantity_sold, unit_price", subtract + add),
+                            ("DELETE", subtract)):
+        conn.execute(f"""
+            CREATE TRIGGER trg_SalesHistory_{operation.split()[0].lower()}_daily AFTER {operation} ON SalesHistory
+            BEGIN
+                {body}
+            END
+        """)
+
+
+def migrate_enforced_row_versions(conn):
+    """Makes every update of Ingredients or Recipes bump the row version, whoever makes it.
+
+    The app always bumps it, but a direct UPDATE (another tool, a script)
+    might not. FoodDatabase.refresh_catalog() finds rows other instances
+    changed by their version, so the triggers make that hold for any writer.
+    """
+    for table in ("Ingredients", "Recipes"):
+        create_row_version_trigger(conn, table)
+
+
+def create_row_version_trigger(conn, table):
+    conn.execute(f"""
+        CREATE TRIGGER trg_{table}_update_row_version AFTER UPDATE ON {table}
+        WHEN NEW.version = OLD.version
+        BEGIN
+            UPDATE {table} SET version = version + 1 WHERE id = NEW.id;
+        END
+    """)
+
+
+def migrate_replicated_ids(conn):
+    """Gives ingredients and recipes a uid that identifies them at every location.
+
+    Replication keyed catalog rows by name, so a rename reached the central
+    database as a delete plus an insert, losing the recipe lines and sales
+    attached to the old row. A uid never changes, so a rename is applied as
+    an update of the name. New rows get a random uid. Existing rows get
+    'name:' plus their name, so sites that migrate separately agree on the
+    rows they share, and the name-keyed RowChanges entries convert the same
+    way. Ingredients and Recipes are rebuilt because an added column can't
+    default to a random value.
+    """
+    # Their bodies refer to the tables being rebuilt
+    for stream in ("Ingredients", "Recipes", "RecipeIngredients"):
+        for name in ("insert", "update", "rekey", "delete"):
+            conn.execute(f"DROP TRIGGER trg_{stream}_{name}_change")
+    conn.execute("""
+        CREATE TABLE Ingredients_replicated (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid TEXT NOT NULL UNIQUE DEFAULT (lower(hex(randomblob(16)))),
+            name TEXT NOT NULL UNIQUE,
+            quantity REAL NOT NULL,
+            unit TEXT NOT NULL,
+            cost_per_unit REAL NOT NULL,
+            threshold REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE Recipes_replicated (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid TEXT NOT NULL UNIQUE DEFAULT (lower(hex(randomblob(16)))),
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            version INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    for table, columns in (("Ingredients", "id, name, quantity, unit, cost_per_unit, threshold, version"),
+                           ("Recipes", "id, name, description, version")):
+        last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        conn.execute(f"INSERT INTO {table}_replicated (uid, {columns}) SELECT 'name:' || name, {columns} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_replicated RENAME TO {table}")
+        if last_id:  # AUTOINCREMENT still mustn't reuse the ids of rows deleted before the rebuild
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, last_id[0]))
+        create_version_triggers(conn, table)
+        create_row_version_trigger(conn, table)
+    conn.execute("""
+        UPDATE RowChanges SET row_key = (SELECT json_group_array('name:' || value) FROM json_each(row_key))
+        WHERE stream IN ('Ingredients', 'Recipes', 'RecipeIngredients')
+    """)
+    for stream in ("Ingredients", "Recipes", "RecipeIngredients"):
+        create_change_triggers(conn, stream)
+
+
+def migrate_uid_aliases(conn):
+    """Records which central row a site's ingredient or recipe was merged into.
+
+    Two sites can each add an ingredient or recipe with the same name, and
+    the two rows get different uids. The central database keeps the first
+    one and maps the other site's uid onto it, so that site's later edits,
+    recipe lines, stock and sales land on the same row (see
+    sync.apply_changeset). stream is "Ingredients" or "Recipes"; the two
+    tables' uids can coincide ('name:' plus the name).
+    """
+    conn.execute("""
+        CREATE TABLE UidAliases (
+            stream TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            local_uid TEXT NOT NULL,
+            PRIMARY KEY (stream, uid)
+        ) WITHOUT ROWID
+    """)
+
+
+def migrate_recipe_tombstones(conn):
+    """Keeps the uid of every deleted recipe, for the sales that still refer to it.
+
+    Sales stay when their recipe is deleted, and replication sends them by
+    recipe uid, so a site's sales recorded before the delete and not yet
+    exported would otherwise never reach the central database. The central
+    database resolves such sales through its own tombstones, since applying
+    the delete there writes one too. Recipes deleted before this migration
+    left no uid behind.
+    """
+    conn.execute("CREATE TABLE RecipeTombstones (id INTEGER PRIMARY KEY, uid TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_recipe_tombstones_uid ON RecipeTombstones(uid)")
+    conn.execute("""
+        CREATE TRIGGER trg_Recipes_delete_tombstone AFTER DELETE ON Recipes
+        BEGIN
+            INSERT INTO RecipeTombstones (id, uid) VALUES (OLD.id, OLD.uid);
+        END
+    """)
+
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records
+# how many have been applied.
+MIGRATIONS = [
+    migrate_compact_sales_history,
+    migrate_row_versions,
+    migrate_unique_recipe_lines,
+    migrate_inventory_lots,
+    migrate_sale_anomaly_stats,
+    migrate_locations,
+    migrate_sale_prices,
+    migrate_daily_sales,
+    migrate_enforced_row_versions,
+    migrate_replicated_ids,
+    migrate_uid_aliases,
+    migrate_recipe_tombstones,
+]
+
+
+def connect(path=DB_PATH, cached_statements=128):
+    """Opens a connection configured for sharing the file with other instances."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=cached_statements)
+    conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_SECONDS * 1000)}")
+    return conn
+
+
+def migrate(conn):
+    """Brings the database up to the latest schema version."""
+    create_tables(conn)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+
+def next_sale_id(cursor):
+    """Reserves and returns the id for a new SalesHistory row."""
+    cursor.execute("UPDATE Sequences SET value = value + 1 WHERE name = 'SalesHistory' RETURNING value")
+    return cursor.fetchone()[0]
+
+
+def _synthetic_sales(rows, recipes, days):
+    """Yields batches of random (date, recipe_id, quantity) sales spread over `days` days."""
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    rng = random.Random(42)
+    batch = []
+    for _ in range(rows):
+        batch.append((start + datetime.timedelta(days=rng.randrange(days)),
+                      rng.randint(1, recipes), float(rng.randint(1, 20))))
+        if len(batch) == 50000:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _build_report_db(path, compact, rows, recipes, days):
+    conn = sqlite3.connect(path)
+    create_tables(conn)
+    if compact:
+        # Only the SalesHistory rebuild; later migrations add tables the legacy file doesn't have
+        migrate_compact_sales_history(conn)
+    conn.executemany("INSERT INTO Recipes (id, name) VALUES (?, ?)",
+                     [(r, f"Recipe {r}") for r in range(1, recipes + 1)])
+    sale_id = 0
+    for batch in _synthetic_sales(rows, recipes, days):
+        if compact:
+            params = []
+            for sale_date, recipe_id, quantity in batch:
+                sale_id += 1
+                params.append((recipe_id, date_to_day(sale_date), sale_id, quantity))
+            conn.executemany("INSERT INTO SalesHistory (recipe_id, sale_day, id, quantity_sold) VALUES (?, ?, ?, ?)",
+                             params)
+        else:
+            conn.executemany("INSERT INTO SalesHistory (sale_date, recipe_id, quantity_sold) VALUES (?, ?, ?)",
+                             [(d.isoformat(), r, q) for d, r, q in batch])
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def _time_range_scans(path, compact, recipes, window):
+    """Runs the demand-prediction query for every recipe and returns the elapsed seconds."""
+    conn = sqlite3.connect(path)
+    start_date = datetime.date.today() - datetime.timedelta(days=window)
+    if compact:
+        sql = "SELECT SUM(quantity_sold) FROM SalesHistory WHERE recipe_id = ? AND sale_day >= ?"
+        start_value = date_to_day(start_date)
+    else:
+        sql = "SELECT SUM(quantity_sold) FROM SalesHistory WHERE recipe_id = ? AND sale_date >= ?"
+        start_value = start_date.isoformat()
+    began = time.perf_counter()
+    for recipe_id in range(1, recipes + 1):
+        conn.execute(sql, (recipe_id, start_value)).fetchone()
+    elapsed = time.perf_counter() - began
+    conn.close()
+    return elapsed
+
+
+def storage_report(rows, recipes=50, days=3 * 365, window=90):
+    """Builds the legacy and compact layouts side by side and prints size and scan timings."""
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, compact in (("legacy", False), ("compact", True)):
+            path = os.path.join(tmp, f"{label}.db")
+            _build_report_db(path, compact, rows, recipes, days)
+            results[label] = (os.path.getsize(path), _time_range_scans(path, compact, recipes, window))
+
+    print(f"SalesHistory storage report: {rows} rows, {recipes} recipes, {window}-day scans")
+    for label, (size, elapsed) in results.items():
+        print(f"  {label:<8} {size / 1024 / 1024:8.2f} MiB   {elapsed * 1000:8.1f} ms")
+    legacy_size, legacy_time = results["legacy"]
+    compact_size, compact_time = results["compact"]
+    print(f"  size: {compact_size / legacy_size:.0%} of legacy, "
+          f"scans: {legacy_time / compact_time:.1f}x faster")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the food business database.")
+    parser.add_argument("--db", default=DB_PATH, help="database file to create/upgrade")
+    parser.add_argument("--report", action="store_true",
+                        help="compare legacy vs compact SalesHistory storage on synthetic data")
+    parser.add_argument("--rows", type=int, default=1000000, help="synthetic rows for --report")
+    args = parser.parse_args()
+
+    if args.report:
+        storage_report(args.rows)
+        return
+
+    conn = connect(args.db)
+    migrate(conn)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    print(f"{args.db} is at schema version {version}")
+
+
+if __name__ == '__main__':
+    main()
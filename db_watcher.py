@@ -0,0 +1,33 @@
+"""Detects changes other connections make to the shared database."""
+
+class ChangeWatcher:
+    """Polls PRAGMA data_version and reports which tables another connection changed.
+
+    data_version only changes when a different connection commits, so an idle
+    poll costs a single pragma. When it does change, the TableVersions
+    counters maintained by triggers show which tables were written.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.data_version = self._read_data_version()
+        self.table_versions = self._read_table_versions()
+
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read_table_versions(self):
+        return dict(self.conn.execute("SELECT name, version FROM TableVersions"))
+
+    def poll(self):
+        """Returns the set of tables changed by other connections since the last poll."""
+        data_version = self._read_data_version()
+        if data_version == self.data_version:
+            return set()
+        self.data_version = data_version
+
+        table_versions = self._read_table_versions()
+        changed = {name for name, version in table_versions.items()
+                   if version != self.table_versions.get(name)}
+        self.table_versions = table_versions
+        return changed
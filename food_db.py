@@ -0,0 +1,683 @@
+"""Data access for the food business database, usable without PyQt5.
+
+    db = FoodDatabase("food_business.db")
+    for ingredient in db.ingredients.all():
+        print(ingredient.name, ingredient.quantity)
+
+Every thread gets its own configured connection (with a larger statement
+cache, since the same few statements run over and over) and rows come back
+as namedtuples, which don't carry a per-row __dict__.
+"""
+import datetime
+import json
+import threading
+from collections import namedtuple
+
+import anomaly
+import db_setup
+from catalog import Catalog
+
+STATEMENT_CACHE_SIZE = 256
+
+# Which inventory lots sales use up first: "fefo" (first expiry, first out)
+# or "fifo" (first received, first out). Lots are taken in (key, id) order,
+# which matches idx_lots_fefo / idx_lots_fifo.
+LOT_ORDER = "fefo"
+LOT_ORDER_KEY = {"fefo": "expiry_day", "fifo": "received_day"}
+# Remaining quantities below this are treated as used up (float rounding)
+LOT_EPSILON = 1e-9
+
+# SQL giving the first day of the bucket a sale falls in (day numbers are
+# Julian days, and Julian day % 7 == 0 is a Monday)
+TREND_BUCKET_SQL = {
+    "day": "sale_day",
+    "week": "sale_day - sale_day % 7",
+    "month": "CAST(julianday(date(sale_day - 0.5, 'start of month')) + 0.5 AS INTEGER)",
+}
+
+Ingredient = namedtuple("Ingredient", "id name quantity unit cost_per_unit threshold version")
+Recipe = namedtuple("Recipe", "id name description version")
+RecipeLine = namedtuple("RecipeLine", "ingredient_id name quantity")
+Sale = namedtuple("Sale", "id sale_day recipe_id recipe_name quantity_sold unit_price flagged location_id location_name")
+Shortage = namedtuple("Shortage", "ingredient_id name available required")
+Location = namedtuple("Location", "id name changeset exported_seq exported_sale_id exported_stock_version")
+Lot = namedtuple("Lot", "id ingredient_id ingredient_name received_day expiry_day quantity_remaining")
+
+
+def id_list(ids):
+    """Encodes ids as one JSON parameter for `IN (SELECT value FROM json_each(?))`.
+
+    Binding a single parameter keeps the SQL text identical whatever the
+    number of ids, so the statement is prepared once and then served from the
+    statement cache.
+    """
+    return json.dumps(list(ids))
+
+
+def record_sale(cursor, recipe_id, sale_day, quantity_sold, unit_price=None):
+    """Inserts a sale and deducts its ingredients from Ingredients.quantity; the caller commits.
+
+    unit_price is what one unit sold for (None if unknown).
+
+    Returns (sale_id, {ingredient_id: quantity consumed}, [Shortage, ...], flagged).
+    Ingredients without enough stock are reported as shortages and left
+    untouched. flagged is True if the quantity is an outlier for the recipe
+    (see update_sale_stats()). Inventory lots aren't updated here;
+    record_sales() does that once per batch.
+    """
+    sale_id = db_setup.next_sale_id(cursor)
+    flagged = update_sale_stats(cursor, recipe_id, quantity_sold)
+    cursor.execute("""
+        INSERT INTO SalesHistory (recipe_id, sale_day, id, quantity_sold, unit_price, flagged)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (recipe_id, sale_day, sale_id, quantity_sold, unit_price, flagged))
+
+    cursor.execute("""
+        SELECT ri.ingredient_id, i.name, i.quantity, ri.quantity_required
+        FROM RecipeIngredients ri
+        JOIN Ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id = ?
+    """, (recipe_id,))
+    consumption = {}
+    shortages = []
+    for ingredient_id, name, current_quantity, quantity_required in cursor.fetchall():
+        total_quantity_needed = quantity_required * quantity_sold
+        consumption[ingredient_id] = total_quantity_needed
+        if current_quantity < total_quantity_needed:
+            shortages.append(Shortage(ingredient_id, name, current_quantity, total_quantity_needed))
+            continue
+        # Deduct relative to the stored value so concurrent sales from another instance aren't lost;
+        # bumping the version makes any open edit of this ingredient detect the change
+        cursor.execute("UPDATE Ingredients SET quantity = quantity - ?, version = version + 1 WHERE id = ?",
+                       (total_quantity_needed, ingredient_id))
+    return sale_id, consumption, shortages, flagged
+
+
+def update_sale_stats(cursor, recipe_id, quantity_sold):
+    """Folds a sale into its recipe's SaleStats row in O(1); returns True if it is an outlier."""
+    cursor.execute("SELECT sample_count, mean, variance FROM SaleStats WHERE recipe_id = ?", (recipe_id,))
+    count, mean, variance, flagged = anomaly.update(*(cursor.fetchone() or (0, 0.0, 0.0)), quantity_sold)
+    cursor.execute("""
+        INSERT INTO SaleStats (recipe_id, sample_count, mean, variance) VALUES (?, ?, ?, ?)
+        ON CONFLICT(recipe_id) DO UPDATE SET
+            sample_count = excluded.sample_count, mean = excluded.mean, variance = excluded.variance
+    """, (recipe_id, count, mean, variance))
+    return flagged
+
+
+def record_sales(cursor, sales):
+    """Records (recipe_id, sale_day, quantity_sold, unit_price) sales and deducts their stock; the caller commits.
+
+    Each sale is checked and deducted from Ingredients.quantity on its own,
+    then everything actually deducted comes out of the inventory lots with a
+    single consume_lots() statement for the whole batch.
+    Returns ([sale ids], {ingredient_id: quantity consumed}, [Shortage, ...],
+    [ids of sales flagged as outliers]).
+    """
+    sale_ids = []
+    consumption = {}
+    deducted = {}
+    shortages = []
+    flagged_ids = []
+    for recipe_id, sale_day, quantity_sold, unit_price in sales:
+        sale_id, used, short, flagged = record_sale(cursor, recipe_id, sale_day, quantity_sold, unit_price)
+        sale_ids.append(sale_id)
+        if flagged:
+            flagged_ids.append(sale_id)
+        short_ids = {shortage.ingredient_id for shortage in short}
+        for ingredient_id, amount in used.items():
+            consumption[ingredient_id] = consumption.get(ingredient_id, 0) + amount
+            if ingredient_id not in short_ids:
+                deducted[ingredient_id] = deducted.get(ingredient_id, 0) + amount
+        shortages.extend(short)
+    consume_lots(cursor, deducted)
+    return sale_ids, consumption, shortages, flagged_ids
+
+
+def consume_lots(cursor, amounts):
+    """Takes {ingredient_id: quantity} out of open inventory lots in LOT_ORDER; the caller commits.
+
+    One UPDATE handles every ingredient. A recursive CTE walks each
+    ingredient's open lots through the lot order index, one index seek per
+    lot, and stops once the amount is covered, so the cost depends on the
+    lots used up rather than on how many lots are open.
+    """
+    if not amounts:
+        return
+    key = LOT_ORDER_KEY[LOT_ORDER]
+    next_lot = f"""
+        SELECT id FROM InventoryLots
+        WHERE ingredient_id = {{ingredient}} AND quantity_remaining > 0 {{after}}
+        ORDER BY {key}, id LIMIT 1
+    """
+    cursor.execute(f"""
+        WITH RECURSIVE need (ingredient_id, amount) AS (
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+        ),
+        queue (id, ingredient_id, sort_key, remaining, amount, used_before) AS (
+            SELECT l.id, l.ingredient_id, l.{key}, l.quantity_remaining, n.amount, 0
+            FROM need n
+            JOIN InventoryLots l ON l.id = ({next_lot.format(ingredient="n.ingredient_id", after="")})
+            UNION ALL
+            SELECT l.id, l.ingredient_id, l.{key}, l.quantity_remaining, q.amount, q.used_before + q.remaining
+            FROM queue q
+            JOIN InventoryLots l ON l.id = ({next_lot.format(ingredient="q.ingredient_id", after=f"AND ({key}, id) > (q.sort_key, q.id)")})
+            WHERE q.used_before + q.remaining < q.amount
+        )
+        UPDATE InventoryLots
+        SET quantity_remaining = CASE
+            WHEN queue.remaining - (queue.amount - queue.used_before) < ? THEN 0
+            ELSE queue.remaining - (queue.amount - queue.used_before)
+        END
+        FROM queue
+        WHERE InventoryLots.id = queue.id
+    """, (json.dumps(list(amounts.items())), LOT_EPSILON))
+
+
+def reconcile_lots(cursor, ingredient_ids, today):
+    """Brings open lots back in line with Ingredients.quantity after a manual stock change.
+
+    A surplus becomes a new lot with no expiry and a shortfall is consumed
+    from the existing lots in LOT_ORDER.
+    """
+    cursor.execute("""
+        SELECT i.id, i.quantity - IFNULL(SUM(l.quantity_remaining), 0)
+        FROM Ingredients i
+        LEFT JOIN InventoryLots l ON l.ingredient_id = i.id AND l.quantity_remaining > 0
+        WHERE i.id IN (SELECT value FROM json_each(?))
+        GROUP BY i.id
+    """, (id_list(ingredient_ids),))
+    differences = cursor.fetchall()
+    cursor.executemany("""
+        INSERT INTO InventoryLots (ingredient_id, received_day, expiry_day, quantity_received, quantity_remaining)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(ingredient_id, today, db_setup.NO_EXPIRY_DAY, difference, difference)
+          for ingredient_id, difference in differences if difference > LOT_EPSILON])
+    consume_lots(cursor, {ingredient_id: -difference
+                          for ingredient_id, difference in differences if difference < -LOT_EPSILON})
+
+
+def today_day():
+    return db_setup.date_to_day(datetime.date.today())
+
+
+class FoodDatabase:
+    """Entry point for data access; the per-table stores hang off it."""
+
+    def __init__(self, path=db_setup.DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._catalog = None
+        db_setup.migrate(self.conn)  # Creates tables / upgrades the schema
+        self.ingredients = IngredientStore(self)
+        self.recipes = RecipeStore(self)
+        self.sales = SalesStore(self)
+        self.lots = LotStore(self)
+        self.locations = LocationStore(self)
+
+    @property
+    def conn(self):
+        """The calling thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = db_setup.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def catalog(self):
+        """The shared Catalog snapshot of ingredients and recipes, loaded on first use.
+
+        Writes made through this object patch it in place. Call
+        refresh_catalog() after another instance changed the catalog tables.
+        Like the GUI that owns it, it is meant for a single thread.
+        """
+        if self._catalog is None:
+            self._catalog = Catalog.load(self)
+        return self._catalog
+
+    def refresh_catalog(self, changed_tables):
+        """Patches the snapshot with the rows another instance changed in changed_tables.
+
+        Every write bumps an ingredient's version, so one (id, version) scan
+        finds the ingredients to re-read; recipes are compared by name. Lines
+        have no version, so a RecipeIngredients change re-reads all of them.
+        """
+        catalog = self._catalog
+        if catalog is None:
+            return
+        if "Ingredients" in changed_tables:
+            self._patch_catalog(ingredient_ids=catalog.changed_ingredients(self.ingredients.versions()))
+        if "Recipes" in changed_tables:
+            self._patch_catalog(recipe_ids=catalog.changed_recipes(self.recipes.names()))
+        if "RecipeIngredients" in changed_tables:
+            catalog.set_lines(self.recipes.all_lines())
+
+    def _patch_catalog(self, ingredient_ids=(), recipe_ids=()):
+        """Re-reads the given rows into the snapshot after a write; does nothing if it isn't loaded."""
+        catalog = self._catalog
+        if catalog is None:
+            return
+        if ingredient_ids:
+            ingredients = self.ingredients.get_many(ingredient_ids)
+            catalog.set_ingredients(ingredients.values())
+            catalog.remove_ingredients(set(ingredient_ids) - ingredients.keys())
+        if recipe_ids:
+            recipes = self.recipes.get_many(recipe_ids)
+            catalog.set_recipes([(recipe.id, recipe.name) for recipe in recipes.values()],
+                                self.recipes.lines_of(recipes))
+            catalog.remove_recipes(set(recipe_ids) - recipes.keys())
+
+    def close(self):
+        """Closes the calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class IngredientStore:
+
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        return list(map(Ingredient._make, self.db.conn.execute("""
+            SELECT id, name, quantity, unit, cost_per_unit, threshold, version FROM Ingredients
+        """)))
+
+    def get(self, ingredient_id):
+        return self.get_many([ingredient_id]).get(ingredient_id)
+
+    def get_many(self, ingredient_ids):
+        """Returns {id: Ingredient} for the ids that exist."""
+        rows = self.db.conn.execute("""
+            SELECT id, name, quantity, unit, cost_per_unit, threshold, version FROM Ingredients
+            WHERE id IN (SELECT value FROM json_each(?))
+        """, (id_list(ingredient_ids),))
+        return {row[0]: Ingredient._make(row) for row in rows}
+
+    def names(self):
+        """Returns [(id, name), ...] for filling pickers."""
+        return self.db.conn.execute("SELECT id, name FROM Ingredients").fetchall()
+
+    def versions(self):
+        """Returns [(id, version), ...] for every ingredient."""
+        return self.db.conn.execute("SELECT id, version FROM Ingredients").fetchall()
+
+    def stock_levels(self):
+        """Returns {id: (quantity, threshold)}."""
+        rows = self.db.conn.execute("SELECT id, quantity, threshold FROM Ingredients")
+        return {ingredient_id: (quantity, threshold) for ingredient_id, quantity, threshold in rows}
+
+    def add(self, name, quantity, unit, cost_per_unit, threshold):
+        """Inserts an ingredient and returns its id; raises sqlite3.IntegrityError for a duplicate name."""
+        with self.db.conn as conn:
+            cursor = conn.execute("""
+                INSERT INTO Ingredients (name, quantity, unit, cost_per_unit, threshold)
+                VALUES (?, ?, ?, ?, ?)
+            """, (name, quantity, unit, cost_per_unit, threshold))
+            reconcile_lots(cursor, [cursor.lastrowid], today_day())  # Opening stock becomes a lot
+        self.db._patch_catalog(ingredient_ids=[cursor.lastrowid])
+        return cursor.lastrowid
+
+    def update(self, ingredient_id, version, name, quantity, unit, cost_per_unit, threshold):
+        """Saves an edit made from `version`; returns False if someone else changed the row meanwhile."""
+        with self.db.conn as conn:
+            cursor = conn.execute("""
+                UPDATE Ingredients
+                SET name = ?, quantity = ?, unit = ?, cost_per_unit = ?, threshold = ?, version = version + 1
+                WHERE id = ? AND version = ?
+            """, (name, quantity, unit, cost_per_unit, threshold, ingredient_id, version))
+            saved = cursor.rowcount > 0
+            if saved:
+                reconcile_lots(cursor, [ingredient_id], today_day())
+        self.db._patch_catalog(ingredient_ids=[ingredient_id])  # Either way, show the latest row
+        return saved
+
+    def delete(self, ingredient_id):
+        with self.db.conn as conn:
+            conn.execute("DELETE FROM InventoryLots WHERE ingredient_id = ?", (ingredient_id,))
+            conn.execute("DELETE FROM Ingredients WHERE id = ?", (ingredient_id,))
+        self.db._patch_catalog(ingredient_ids=[ingredient_id])
+
+    def upsert_many(self, rows):
+        """Inserts or updates (name, quantity, unit, cost_per_unit, threshold) rows by name in one transaction."""
+        rows = list(rows)
+        with self.db.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO Ingredients (name, quantity, unit, cost_per_unit, threshold)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    quantity = excluded.quantity, unit = excluded.unit,
+                    cost_per_unit = excluded.cost_per_unit, threshold = excluded.threshold,
+                    version = version + 1
+            """, rows)
+            cursor.execute("SELECT id FROM Ingredients WHERE name IN (SELECT value FROM json_each(?))",
+                           (json.dumps([row[0] for row in rows]),))
+            ingredient_ids = [row[0] for row in cursor.fetchall()]
+            reconcile_lots(cursor, ingredient_ids, today_day())
+        self.db._patch_catalog(ingredient_ids=ingredient_ids)
+
+
+class RecipeStore:
+
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        return list(map(Recipe._make, self.db.conn.execute("""
+            SELECT id, name, description, version FROM Recipes
+        """)))
+
+    def get(self, recipe_id):
+        return self.get_many([recipe_id]).get(recipe_id)
+
+    def get_many(self, recipe_ids):
+        """Returns {id: Recipe} for the ids that exist."""
+        rows = self.db.conn.execute("""
+            SELECT id, name, description, version FROM Recipes
+            WHERE id IN (SELECT value FROM json_each(?))
+        """, (id_list(recipe_ids),))
+        return {row[0]: Recipe._make(row) for row in rows}
+
+    def names(self):
+        """Returns [(id, name), ...] for filling pickers."""
+        return self.db.conn.execute("SELECT id, name FROM Recipes").fetchall()
+
+    def lines(self, recipe_id):
+        """Returns the recipe's ingredients as RecipeLine records."""
+        return list(map(RecipeLine._make, self.db.conn.execute("""
+            SELECT i.id, i.name, ri.quantity_required
+            FROM RecipeIngredients ri
+            JOIN Ingredients i ON ri.ingredient_id = i.id
+            WHERE ri.recipe_id = ?
+        """, (recipe_id,))))
+
+    def all_lines(self):
+        """Returns every (recipe_id, ingredient_id, quantity_required) row."""
+        return self.db.conn.execute("""
+            SELECT recipe_id, ingredient_id, quantity_required FROM RecipeIngredients
+        """).fetchall()
+
+    def lines_of(self, recipe_ids):
+        """Returns the (recipe_id, ingredient_id, quantity_required) rows of the given recipes."""
+        return self.db.conn.execute("""
+            SELECT recipe_id, ingredient_id, quantity_required FROM RecipeIngredients
+            WHERE recipe_id IN (SELECT value FROM json_each(?))
+        """, (id_list(recipe_ids),)).fetchall()
+
+    def _save_lines(self, conn, lines_by_recipe):
+        """Makes RecipeIngredients match {recipe_id: [(ingredient_id, quantity), ...]}.
+
+        Only the difference is written: lines that disappeared are deleted,
+        new or changed ones are upserted on (recipe_id, ingredient_id), and
+        unchanged lines aren't touched.
+        """
+        existing = {}
+        for recipe_id, ingredient_id, quantity in conn.execute("""
+            SELECT recipe_id, ingredient_id, quantity_required
+            FROM RecipeIngredients
+            WHERE recipe_id IN (SELECT value FROM json_each(?))
+        """, (id_list(lines_by_recipe),)).fetchall():
+            existing[(recipe_id, ingredient_id)] = quantity
+
+        wanted = {(recipe_id, ingredient_id): quantity
+                  for recipe_id, lines in lines_by_recipe.items()
+                  for ingredient_id, quantity in lines}
+        conn.executemany("DELETE FROM RecipeIngredients WHERE recipe_id = ? AND ingredient_id = ?",
+                         [key for key in existing if key not in wanted])
+        conn.executemany("""
+            INSERT INTO RecipeIngredients (recipe_id, ingredient_id, quantity_required)
+            VALUES (?, ?, ?)
+            ON CONFLICT (recipe_id, ingredient_id) DO UPDATE SET quantity_required = excluded.quantity_required
+        """, [(recipe_id, ingredient_id, quantity) for (recipe_id, ingredient_id), quantity in wanted.items()
+              if existing.get((recipe_id, ingredient_id)) != quantity])
+
+    def add(self, name, description, lines):
+        """Inserts a recipe with its (ingredient_id, quantity) lines and returns its id."""
+        with self.db.conn as conn:
+            recipe_id = conn.execute("INSERT INTO Recipes (name, description) VALUES (?, ?)",
+                                     (name, description)).lastrowid
+            self._save_lines(conn, {recipe_id: lines})
+        self.db._patch_catalog(recipe_ids=[recipe_id])
+        return recipe_id
+
+    def update(self, recipe_id, version, name, description, lines):
+        """Saves an edit made from `version`; returns False if someone else changed the recipe meanwhile."""
+        with self.db.conn as conn:
+            cursor = conn.execute("""
+                UPDATE Recipes SET name = ?, description = ?, version = version + 1
+                WHERE id = ? AND version = ?
+            """, (name, description, recipe_id, version))
+            saved = cursor.rowcount > 0
+            if saved:
+                self._save_lines(conn, {recipe_id: lines})
+        self.db._patch_catalog(recipe_ids=[recipe_id])  # Either way, show the latest version
+        return saved
+
+    def delete(self, recipe_id):
+        with self.db.conn as conn:
+            conn.execute("DELETE FROM RecipeIngredients WHERE recipe_id = ?", (recipe_id,))
+            conn.execute("DELETE FROM SaleStats WHERE recipe_id = ?", (recipe_id,))
+            conn.execute("DELETE FROM Recipes WHERE id = ?", (recipe_id,))
+        self.db._patch_catalog(recipe_ids=[recipe_id])
+
+    def upsert_many(self, recipes):
+        """Inserts or updates (name, description, lines) recipes by name in one transaction.
+
+        Statements are batched with executemany, so thousands of recipes cost
+        a handful of round trips. Returns {name: recipe_id}.
+        """
+        recipes = {name: (description, lines) for name, description, lines in recipes}
+        with self.db.conn as conn:
+            conn.executemany("""
+                INSERT INTO Recipes (name, description) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET description = excluded.description, version = version + 1
+            """, [(name, description) for name, (description, _) in recipes.items()])
+            recipe_ids = dict(conn.execute("""
+                SELECT name, id FROM Recipes WHERE name IN (SELECT value FROM json_each(?))
+            """, (json.dumps(list(recipes)),)).fetchall())
+            self._save_lines(conn, {recipe_ids[name]: lines for name, (_, lines) in recipes.items()})
+        self.db._patch_catalog(recipe_ids=list(recipe_ids.values()))
+        return recipe_ids
+
+
+class SalesStore:
+
+    def __init__(self, db):
+        self.db = db
+
+    def history(self):
+        """Returns every sale as a Sale record, newest first."""
+        return list(map(Sale._make, self.db.conn.execute("""
+            SELECT sh.id, sh.sale_day, sh.recipe_id, r.name, sh.quantity_sold, sh.unit_price, sh.flagged,
+                   sh.location_id, l.name
+            FROM SalesHistory sh
+            JOIN Recipes r ON sh.recipe_id = r.id
+            LEFT JOIN Locations l ON sh.location_id = l.id
+            ORDER BY sh.sale_day DESC, sh.id DESC
+        """)))
+
+    def record(self, recipe_id, sale_day, quantity_sold, unit_price=None):
+        """Records one sale and deducts its ingredients; see record_sale() for the return value."""
+        with self.db.conn as conn:
+            sale_ids, consumption, shortages, flagged_ids = record_sales(
+                conn.cursor(), [(recipe_id, sale_day, quantity_sold, unit_price)])
+        self.db._patch_catalog(ingredient_ids=list(consumption))  # Stock levels changed
+        return sale_ids[0], consumption, shortages, bool(flagged_ids)
+
+    def record_many(self, sales):
+        """Records (recipe_id, sale_day, quantity_sold, unit_price) sales in one transaction.
+
+        Returns (total {ingredient_id: consumed}, [Shortage, ...], [flagged sale ids]).
+        """
+        with self.db.conn as conn:
+            _, consumption, shortages, flagged_ids = record_sales(conn.cursor(), sales)
+        self.db._patch_catalog(ingredient_ids=list(consumption))
+        return consumption, shortages, flagged_ids
+
+    def set_flagged(self, sale, flagged):
+        """Marks or clears a Sale as an outlier by hand (the running statistics are left as they are)."""
+        with self.db.conn as conn:
+            conn.execute("""
+                UPDATE SalesHistory SET flagged = ?
+                WHERE recipe_id = ? AND sale_day = ? AND location_id = ? AND id = ?
+            """, (int(flagged), sale.recipe_id, sale.sale_day, sale.location_id, sale.id))
+
+    def demand_totals(self, recipe_ids, start_day, exclude_flagged=False):
+        """Returns {recipe_id: quantity sold since start_day} (range scans on the primary key).
+
+        With exclude_flagged, sales flagged as outliers are left out.
+        """
+        rows = self.db.conn.execute(f"""
+            SELECT recipe_id, SUM(quantity_sold)
+            FROM SalesHistory
+            WHERE recipe_id IN (SELECT value FROM json_each(?)) AND sale_day >= ?
+            {"AND NOT flagged" if exclude_flagged else ""}
+            GROUP BY recipe_id
+        """, (id_list(recipe_ids), start_day))
+        return dict(rows)
+
+    def price_observations(self, recipe_ids, start_day):
+        """Returns (recipe_id, units sold, average unit price) per recipe and day since start_day.
+
+        Only sales with a recorded price count, and sales flagged as outliers
+        are left out. Read from DailySalePrices (one row per recipe and day),
+        so the cost doesn't grow with the number of sales per day.
+        """
+        return self.db.conn.execute("""
+            SELECT recipe_id, quantity, revenue / quantity
+            FROM DailySalePrices
+            WHERE recipe_id IN (SELECT value FROM json_each(?)) AND sale_day >= ?
+        """, (id_list(recipe_ids), start_day)).fetchall()
+
+    def daily_ingredient_consumption(self, first_day, last_day):
+        """Yields (ingredient_id, day, quantity consumed) for every day with sales in the range.
+
+        Sales flagged as outliers are left out, so a typo doesn't inflate reorder points.
+        """
+        return self.db.conn.execute("""
+            SELECT ri.ingredient_id, sh.sale_day, SUM(sh.quantity_sold * ri.quantity_required)
+            FROM SalesHistory sh
+            JOIN RecipeIngredients ri ON ri.recipe_id = sh.recipe_id
+            WHERE sh.sale_day BETWEEN ? AND ? AND NOT sh.flagged
+            GROUP BY ri.ingredient_id, sh.sale_day
+        """, (first_day, last_day))
+
+    def trend(self, bucket, recipe_id=None):
+        """Returns [(bucket_start_day, recipe_id, units sold, units without a price, revenue)]
+        aggregated in SQL.
+
+        Revenue sums quantity_sold * unit_price over the sales that have a
+        price; units without a price are counted separately so the caller can
+        estimate their revenue. bucket is "day", "week" or "month". Read from
+        DailySales (one row per recipe and day), so the bucket is computed per
+        day rather than per sale. With a recipe_id only that recipe's rows are
+        read, as a range of the primary key.
+        """
+        bucket_sql = TREND_BUCKET_SQL[bucket]
+        sums = "SUM(quantity), SUM(unpriced_quantity), SUM(revenue)"
+        if recipe_id is None:
+            return self.db.conn.execute(f"""
+                SELECT {bucket_sql} AS bucket, recipe_id, {sums}
+                FROM DailySales
+                GROUP BY recipe_id, bucket
+            """).fetchall()
+        return self.db.conn.execute(f"""
+            SELECT {bucket_sql} AS bucket, recipe_id, {sums}
+            FROM DailySales
+            WHERE recipe_id = ?
+            GROUP BY bucket
+        """, (recipe_id,)).fetchall()
+
+
+class LotStore:
+
+    def __init__(self, db):
+        self.db = db
+
+    def receive(self, ingredient_id, quantity, received_day, expiry_day=db_setup.NO_EXPIRY_DAY):
+        """Books a delivery as a new lot and adds it to the ingredient's total; returns the lot id."""
+        with self.db.conn as conn:
+            lot_id = conn.execute("""
+                INSERT INTO InventoryLots (ingredient_id, received_day, expiry_day, quantity_received, quantity_remaining)
+                VALUES (?, ?, ?, ?, ?)
+            """, (ingredient_id, received_day, expiry_day, quantity, quantity)).lastrowid
+            conn.execute("UPDATE Ingredients SET quantity = quantity + ?, version = version + 1 WHERE id = ?",
+                         (quantity, ingredient_id))
+        self.db._patch_catalog(ingredient_ids=[ingredient_id])
+        return lot_id
+
+    def expiring(self, until_day, limit=1000):
+        """Returns open lots expiring on or before until_day, soonest first (read from the expiry index)."""
+        return list(map(Lot._make, self.db.conn.execute("""
+            SELECT l.id, l.ingredient_id, i.name, l.received_day, l.expiry_day, l.quantity_remaining
+            FROM InventoryLots l
+            JOIN Ingredients i ON i.id = l.ingredient_id
+            WHERE l.quantity_remaining > 0 AND l.expiry_day <= ?
+            ORDER BY l.expiry_day, l.id
+            LIMIT ?
+        """, (until_day, limit))))
+
+    def open_lots(self, ingredient_id):
+        """Returns the ingredient's open lots in the order sales will use them."""
+        return list(map(Lot._make, self.db.conn.execute(f"""
+            SELECT l.id, l.ingredient_id, i.name, l.received_day, l.expiry_day, l.quantity_remaining
+            FROM InventoryLots l
+            JOIN Ingredients i ON i.id = l.ingredient_id
+            WHERE l.ingredient_id = ? AND l.quantity_remaining > 0
+            ORDER BY l.{LOT_ORDER_KEY[LOT_ORDER]}, l.id
+        """, (ingredient_id,))))
+
+
+class LocationStore:
+
+    def __init__(self, db):
+        self.db = db
+
+    def all(self):
+        """Returns every known Location; this database's own comes first."""
+        return list(map(Location._make, self.db.conn.execute("""
+            SELECT id, name, changeset, exported_seq, exported_sale_id, exported_stock_version
+            FROM Locations ORDER BY id
+        """)))
+
+    def local(self):
+        return Location._make(self.db.conn.execute("""
+            SELECT id, name, changeset, exported_seq, exported_sale_id, exported_stock_version
+            FROM Locations WHERE id = ?
+        """, (db_setup.LOCAL_LOCATION_ID,)).fetchone())
+
+    def rename_local(self, name):
+        with self.db.conn as conn:
+            conn.execute("UPDATE Locations SET name = ? WHERE id = ?", (name, db_setup.LOCAL_LOCATION_ID))
+
+    def stock(self):
+        """Returns (ingredient, unit, location, quantity) rows for every location, by ingredient.
+
+        This database's own stock is Ingredients.quantity; the other
+        locations' stock is as of their last applied changeset.
+        """
+        return self.db.conn.execute("""
+            SELECT i.name, i.unit, l.name, s.quantity
+            FROM (SELECT ? AS location_id, id AS ingredient_id, quantity FROM Ingredients
+                  UNION ALL
+                  SELECT location_id, ingredient_id, quantity FROM LocationStock) s
+            JOIN Ingredients i ON i.id = s.ingredient_id
+            JOIN Locations l ON l.id = s.location_id
+            ORDER BY i.name, l.id
+        """, (db_setup.LOCAL_LOCATION_ID,)).fetchall()
+
+    def sales(self, start_day):
+        """Returns (recipe, location, quantity sold) rows since start_day, by recipe."""
+        return self.db.conn.execute("""
+            SELECT r.name, l.name, SUM(sh.quantity_sold)
+            FROM SalesHistory sh
+            JOIN Recipes r ON r.id = sh.recipe_id
+            JOIN Locations l ON l.id = sh.location_id
+            WHERE sh.sale_day >= ?
+            GROUP BY sh.recipe_id, sh.location_id
+            ORDER BY r.name, l.id
+        """, (start_day,)).fetchall()
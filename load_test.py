@@ -0,0 +1,227 @@
+"""Load-tests concurrent sales writers and prediction/cost readers against SQLite.
+
+Each configuration runs on a freshly seeded temporary database:
+
+    python load_test.py --writers 4 --readers 2 --duration 10 \\
+        --journal-mode wal delete --synchronous normal full --batch-size 1 20
+
+Writers repeat the app's sale path (food_db.record_sales: insert into
+SalesHistory, then deduct ingredients and inventory lots) with `batch size` sales per
+transaction. Readers repeat the batched cost and demand queries used by the
+predictions tab.
+"""
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db_setup
+import food_db
+
+# Each ingredient gets this many small dated lots before one large lot that
+# never runs out, so sales walk across lots the way they do in a real kitchen
+SEED_LOTS_PER_INGREDIENT = 20
+SEED_LOT_QUANTITY = 50.0
+SEED_STOCK = 1e12
+
+
+def seed_database(path, recipes, ingredients, history_days, sales_per_day):
+    """Creates a database with a synthetic catalog, open inventory lots and some sales history."""
+    conn = db_setup.connect(path)
+    db_setup.migrate(conn)
+    rng = random.Random(1)
+    conn.executemany("INSERT INTO Ingredients (id, name, quantity, unit, cost_per_unit, threshold) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"Ingredient {i}", SEED_STOCK, "kg", rng.uniform(1, 100), 10.0) for i in range(1, ingredients + 1)])
+    conn.executemany("INSERT INTO Recipes (id, name) VALUES (?, ?)",
+                     [(r, f"Recipe {r}") for r in range(1, recipes + 1)])
+    conn.executemany("INSERT INTO RecipeIngredients (recipe_id, ingredient_id, quantity_required) VALUES (?, ?, ?)",
+                     [(r, i, rng.uniform(0.05, 2)) for r in range(1, recipes + 1)
+                      for i in rng.sample(range(1, ingredients + 1), min(5, ingredients))])
+    today = db_setup.date_to_day(datetime.date.today())
+    # Lots add up to Ingredients.quantity; the small ones expire a day apart
+    lots = [(i, today - n, today + n, SEED_LOT_QUANTITY) for i in range(1, ingredients + 1)
+            for n in range(1, SEED_LOTS_PER_INGREDIENT + 1)]
+    lots += [(i, today, db_setup.NO_EXPIRY_DAY, SEED_STOCK - SEED_LOTS_PER_INGREDIENT * SEED_LOT_QUANTITY)
+             for i in range(1, ingredients + 1)]
+    conn.executemany("""
+        INSERT INTO InventoryLots (ingredient_id, received_day, expiry_day, quantity_received, quantity_remaining)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(*lot, lot[-1]) for lot in lots])
+    cursor = conn.cursor()
+    for day in range(today - history_days, today):
+        for _ in range(sales_per_day):
+            cursor.execute("INSERT INTO SalesHistory (recipe_id, sale_day, id, quantity_sold) VALUES (?, ?, ?, ?)",
+                           (rng.randint(1, recipes), day, db_setup.next_sale_id(cursor), float(rng.randint(1, 5))))
+    conn.commit()
+    conn.close()
+
+
+def open_connection(path, journal_mode, synchronous, busy_timeout):
+    # Autocommit mode so transactions are started explicitly and lock waits can be timed
+    conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    return conn
+
+
+def writer_process(path, config, recipes, start_event, stop_at, results):
+    conn = open_connection(path, config["journal_mode"], config["synchronous"], config["busy_timeout"])
+    cursor = conn.cursor()
+    rng = random.Random(os.getpid())
+    today = db_setup.date_to_day(datetime.date.today())
+    latencies, lock_waits = [], []
+    sales = errors = 0
+
+    start_event.wait()
+    while time.time() < stop_at:
+        began = time.perf_counter()
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front, so its duration is the lock wait
+            cursor.execute("BEGIN IMMEDIATE")
+            locked = time.perf_counter()
+            food_db.record_sales(cursor, [(rng.randint(1, recipes), today, float(rng.randint(1, 5)), None)
+                                          for _ in range(config["batch_size"])])
+            cursor.execute("COMMIT")
+        except sqlite3.OperationalError:
+            errors += 1  # "database is locked" after the busy timeout
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            continue
+        finished = time.perf_counter()
+        lock_waits.append(locked - began)
+        latencies.append(finished - began)
+        sales += config["batch_size"]
+
+    conn.close()
+    results.put(("writer", sales, errors, latencies, lock_waits))
+
+
+def reader_process(path, config, recipes, start_event, stop_at, results):
+    conn = open_connection(path, config["journal_mode"], config["synchronous"], config["busy_timeout"])
+    cursor = conn.cursor()
+    recipe_ids = food_db.id_list(range(1, recipes + 1))
+    start_day = db_setup.date_to_day(datetime.date.today() - datetime.timedelta(days=30))
+    latencies = []
+    queries = errors = 0
+
+    start_event.wait()
+    while time.time() < stop_at:
+        began = time.perf_counter()
+        try:
+            cursor.execute("""
+                SELECT ri.recipe_id, SUM(ri.quantity_required * i.cost_per_unit)
+                FROM RecipeIngredients ri
+                JOIN Ingredients i ON ri.ingredient_id = i.id
+                WHERE ri.recipe_id IN (SELECT value FROM json_each(?))
+                GROUP BY ri.recipe_id
+            """, (recipe_ids,)).fetchall()
+            cursor.execute("""
+                SELECT recipe_id, SUM(quantity_sold)
+                FROM SalesHistory
+                WHERE recipe_id IN (SELECT value FROM json_each(?)) AND sale_day >= ?
+                GROUP BY recipe_id
+            """, (recipe_ids, start_day)).fetchall()
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+        queries += 1
+
+    conn.close()
+    results.put(("reader", queries, errors, latencies, []))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_configuration(config, args):
+    """Seeds a database, runs the writers and readers for args.duration seconds and returns the summary."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "load_test.db")
+        seed_database(path, args.recipes, args.ingredients, args.history_days, args.sales_per_day)
+        # journal_mode=wal is stored in the file; switch back explicitly for rollback-journal runs
+        conn = sqlite3.connect(path)
+        conn.execute(f"PRAGMA journal_mode = {config['journal_mode']}")
+        conn.close()
+
+        start_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        stop_at = time.time() + args.duration + 0.5
+        processes = [multiprocessing.Process(target=writer_process,
+                                             args=(path, config, args.recipes, start_event, stop_at, results))
+                     for _ in range(args.writers)]
+        processes += [multiprocessing.Process(target=reader_process,
+                                              args=(path, config, args.recipes, start_event, stop_at, results))
+                      for _ in range(args.readers)]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)  # Let every process open its connection before the clock starts
+        start_event.set()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    summary = {"sales": 0, "write_errors": 0, "write_latencies": [], "lock_waits": [],
+               "queries": 0, "read_errors": 0, "read_latencies": []}
+    for kind, count, errors, latencies, lock_waits in collected:
+        if kind == "writer":
+            summary["sales"] += count
+            summary["write_errors"] += errors
+            summary["write_latencies"] += latencies
+            summary["lock_waits"] += lock_waits
+        else:
+            summary["queries"] += count
+            summary["read_errors"] += errors
+            summary["read_latencies"] += latencies
+    return summary
+
+
+def print_summary(config, summary, duration):
+    ms = 1000
+    writes = summary["write_latencies"]
+    waits = summary["lock_waits"]
+    reads = summary["read_latencies"]
+    print(f"{config['journal_mode']:>6} {config['synchronous']:>6} {config['batch_size']:>5} | "
+          f"{summary['sales'] / duration:9.1f} {summary['write_errors']:6} "
+          f"{percentile(writes, 0.5) * ms:7.2f} {percentile(writes, 0.99) * ms:8.2f} "
+          f"{(sum(waits) / len(waits) if waits else 0) * ms:8.2f} {percentile(waits, 0.99) * ms:8.2f} | "
+          f"{summary['queries'] / duration:8.1f} {summary['read_errors']:6} "
+          f"{percentile(reads, 0.5) * ms:7.2f} {percentile(reads, 0.99) * ms:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure sales write throughput and lock contention.")
+    parser.add_argument("--writers", type=int, default=4, help="writer processes")
+    parser.add_argument("--readers", type=int, default=2, help="reader processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per configuration")
+    parser.add_argument("--journal-mode", nargs="+", default=["wal", "delete"])
+    parser.add_argument("--synchronous", nargs="+", default=["normal", "full"])
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[1, 20], help="sales per transaction")
+    parser.add_argument("--busy-timeout", type=float, default=db_setup.BUSY_TIMEOUT_SECONDS)
+    parser.add_argument("--recipes", type=int, default=50)
+    parser.add_argument("--ingredients", type=int, default=200)
+    parser.add_argument("--history-days", type=int, default=90)
+    parser.add_argument("--sales-per-day", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.duration:g}s per configuration; times in ms")
+    print(f"{'journal':>6} {'sync':>6} {'batch':>5} | {'sales/s':>9} {'locked':>6} {'p50':>7} {'p99':>8} "
+          f"{'wait avg':>8} {'wait p99':>8} | {'reads/s':>8} {'locked':>6} {'p50':>7} {'p99':>8}")
+    for journal_mode, synchronous, batch_size in itertools.product(args.journal_mode, args.synchronous,
+                                                                   args.batch_size):
+        config = {"journal_mode": journal_mode, "synchronous": synchronous,
+                  "batch_size": batch_size, "busy_timeout": args.busy_timeout}
+        print_summary(config, run_configuration(config, args), args.duration)
+
+
+if __name__ == '__main__':
+    main()
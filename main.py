@@ -1,19 +1,54 @@
+import math
 import sys
 import sqlite3
 from PyQt5.QtWidgets import (QApplication, QWidget, QTabWidget, QVBoxLayout,
                              QLabel, QLineEdit, QPushButton, QTableWidget,
                              QTableWidgetItem, QHeaderView, QComboBox, QMessageBox,
                              QFormLayout, QHBoxLayout, QDialog, QDialogButtonBox,
-                             QSpinBox, QDoubleSpinBox, QDateEdit)
-from PyQt5.QtCore import Qt, QDate
+                             QSpinBox, QDoubleSpinBox, QDateEdit, QCheckBox,
+                             QFileDialog)
+from PyQt5.QtCore import Qt, QDate, QTimer
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+
+import db_setup
+from db_watcher import ChangeWatcher
+from food_db import FoodDatabase, RecipeLine
+from menu_import import import_menu, read_menu_file
+from pricing import PRICING_WINDOW_DAYS, DemandCurve, fit_recipes, profit_maximizing_prices
+from reorder import ReorderPlanner
+from result_cache import ResultCache
+from scenarios import CostModel
+from trend_chart import TrendChart
+from trends import BUCKETS, build_series
+
+# How often to check whether another instance changed the database.
+CHANGE_POLL_INTERVAL_MS = 1000
+
+# Default look-ahead of the expiring lots list
+EXPIRING_WITHIN_DAYS = 7
+
+# The price scenario results show at most this many scenarios, those that move prices most
+MAX_SCENARIO_COLUMNS = 25
+
+# Tables each cached computation reads (see ResultCache)
+PREDICTED_DEMAND_TABLES = ("SalesHistory",)
+
 
 class FoodBusinessApp(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Food Business Management System")
-        self.db_connection = sqlite3.connect("food_business.db")  
+        self.db = FoodDatabase(db_setup.DB_PATH)
+        self.result_cache = ResultCache()
+        self.reorder_planner = ReorderPlanner()
         self.initUI()
 
+        # Refresh tabs when another instance writes to the shared database
+        self.change_watcher = ChangeWatcher(self.db.conn)
+        self.change_timer = QTimer(self)
+        self.change_timer.timeout.connect(self.refresh_changed_tabs)
+        self.change_timer.start(CHANGE_POLL_INTERVAL_MS)
+
     def initUI(self):
         
         self.tabs = QTabWidget()
@@ -23,24 +58,74 @@ class FoodBusinessApp(QWidget):
         self.recipes_tab = QWidget()
         self.sales_tab = QWidget()
         self.predictions_tab = QWidget()
+        self.trends_tab = QWidget()
+        self.lots_tab = QWidget()
 
         # Add the tabs to the tab widget
         self.tabs.addTab(self.ingredients_tab, "Ingredients")
         self.tabs.addTab(self.recipes_tab, "Recipes")
         self.tabs.addTab(self.sales_tab, "Sales History")
         self.tabs.addTab(self.predictions_tab, "Predictions & Pricing")
+        self.tabs.addTab(self.trends_tab, "Sales Trends")
+        self.tabs.addTab(self.lots_tab, "Inventory Lots")
 
         # Set up the layout for each tab
         self.setup_ingredients_tab()
         self.setup_recipes_tab()
         self.setup_sales_tab()
         self.setup_predictions_tab()
+        self.setup_trends_tab()
+        self.setup_lots_tab()
+        # Sales and stock edits on other tabs use up lots; refresh when shown
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+        # The default sale price comes from the pricing controls, which exist only now
+        self.sales_recipe_combo.currentIndexChanged.connect(self.fill_sale_price)
+        self.fill_sale_price()
 
         
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.tabs)
         self.setLayout(main_layout)
 
+    def refresh_changed_tabs(self):
+        """Reloads only the views that depend on tables another instance changed."""
+        try:
+            changed_tables = self.change_watcher.poll()
+        except sqlite3.Error:
+            return  # Database busy; try again on the next tick
+        if not changed_tables:
+            return
+
+        self.result_cache.invalidate_tables(changed_tables)
+        self.db.refresh_catalog(changed_tables)
+        if changed_tables & {"SalesHistory", "RecipeIngredients"}:
+            self.reorder_planner.invalidate()
+        if changed_tables & {"Ingredients", "RecipeIngredients", "SalesHistory"}:
+            self.load_ingredients()
+        if changed_tables & {"Ingredients", "Recipes", "RecipeIngredients"}:
+            self.load_recipes()
+        if "Recipes" in changed_tables:
+            self.populate_recipe_combobox()
+        if changed_tables & {"Recipes", "SalesHistory"}:
+            self.load_sales_history()
+        if changed_tables & {"Ingredients", "Recipes", "RecipeIngredients", "SalesHistory"}:
+            self.load_predictions()
+        if "Recipes" in changed_tables:
+            self.populate_trend_recipe_combobox()
+        if changed_tables & {"Ingredients", "RecipeIngredients", "SalesHistory"}:
+            self.load_trends()
+        if "Ingredients" in changed_tables:
+            self.populate_lot_ingredient_combobox()
+        if changed_tables & {"Ingredients", "InventoryLots"}:
+            self.load_expiring_lots()
+
+    def on_tab_changed(self, index):
+        if self.tabs.widget(index) is self.lots_tab:
+            self.populate_lot_ingredient_combobox()
+            self.load_expiring_lots()
+        elif self.tabs.widget(index) is self.trends_tab and self.trends_stale:
+            self.load_trends()
+
     def setup_ingredients_tab(self):
         
         layout = QVBoxLayout()
@@ -71,15 +156,29 @@ class FoodBusinessApp(QWidget):
         button_layout.addWidget(self.edit_ingredient_button)
         button_layout.addWidget(self.delete_ingredient_button)
 
+        #  Reorder point controls 
+        reorder_layout = QHBoxLayout()
+        self.dynamic_reorder_checkbox = QCheckBox("Dynamic reorder points (from sales)")
+        self.dynamic_reorder_checkbox.setToolTip("Highlight low stock using forecast consumption and lead time "
+                                                 "instead of the fixed threshold.")
+        self.lead_time_spinbox = QSpinBox()
+        self.lead_time_spinbox.setRange(1, 60)
+        self.lead_time_spinbox.setValue(self.reorder_planner.lead_time_days)
+        self.lead_time_spinbox.setSuffix(" days")
+        reorder_layout.addWidget(self.dynamic_reorder_checkbox)
+        reorder_layout.addWidget(QLabel("Lead Time:"))
+        reorder_layout.addWidget(self.lead_time_spinbox)
+
         #  Table 
         self.ingredients_table = QTableWidget()
-        self.ingredients_table.setColumnCount(6)  
-        self.ingredients_table.setHorizontalHeaderLabels(["ID", "Name", "Quantity", "Unit", "Cost/Unit", "Threshold"])
+        self.ingredients_table.setColumnCount(7)  
+        self.ingredients_table.setHorizontalHeaderLabels(["ID", "Name", "Quantity", "Unit", "Cost/Unit", "Threshold", "Reorder Point"])
         self.ingredients_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch) 
 
         
         layout.addLayout(form_layout)
         layout.addLayout(button_layout)
+        layout.addLayout(reorder_layout)
         layout.addWidget(self.ingredients_table)
         self.ingredients_tab.setLayout(layout)
 
@@ -87,6 +186,8 @@ class FoodBusinessApp(QWidget):
         self.add_ingredient_button.clicked.connect(self.add_ingredient)
         self.edit_ingredient_button.clicked.connect(self.edit_ingredient) 
         self.delete_ingredient_button.clicked.connect(self.delete_ingredient)
+        self.dynamic_reorder_checkbox.toggled.connect(self.update_low_stock_indicators)
+        self.lead_time_spinbox.valueChanged.connect(self.update_low_stock_indicators)
         self.load_ingredients() 
 
 
@@ -117,12 +218,7 @@ class FoodBusinessApp(QWidget):
 
         
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("""
-                INSERT INTO Ingredients (name, quantity, unit, cost_per_unit, threshold)
-                VALUES (?, ?, ?, ?, ?)
-            """, (name, quantity, unit, cost_per_unit, threshold))
-            self.db_connection.commit()
+            self.db.ingredients.add(name, quantity, unit, cost_per_unit, threshold)
             QMessageBox.information(self, "Success", "Ingredient added successfully!")
             self.clear_ingredient_form()
             self.load_ingredients()  
@@ -133,14 +229,12 @@ class FoodBusinessApp(QWidget):
 
     def load_ingredients(self):
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT id, name, quantity, unit, cost_per_unit, threshold FROM Ingredients")
-            rows = cursor.fetchall()
+            ingredients = self.db.catalog.ingredient_rows()
 
             self.ingredients_table.setRowCount(0)  
-            for row_num, row_data in enumerate(rows):
+            for row_num, ingredient in enumerate(ingredients):
                 self.ingredients_table.insertRow(row_num)
-                for col_num, cell_data in enumerate(row_data):
+                for col_num, cell_data in enumerate(ingredient):
                     item = QTableWidgetItem(str(cell_data))
                     if col_num == 0: 
                         item.setFlags(item.flags() & ~Qt.ItemIsEditable)
@@ -159,14 +253,29 @@ class FoodBusinessApp(QWidget):
         self.ingredient_threshold_edit.clear()
 
     def update_low_stock_indicators(self):
+        """Highlights ingredients below the threshold, or below their computed reorder point in dynamic mode."""
         try:
-            cursor = self.db_connection.cursor()
+            catalog = self.db.catalog
+
+            reorder_points = None
+            if self.dynamic_reorder_checkbox.isChecked():
+                self.reorder_planner.lead_time_days = self.lead_time_spinbox.value()
+                self.reorder_planner.ensure_current(self.db, QDate.currentDate().toJulianDay())
+                reorder_points = self.reorder_planner.reorder_points()
+
             for row in range(self.ingredients_table.rowCount()):
                 item_id = int(self.ingredients_table.item(row, 0).text())  # Get ID
-                cursor.execute("SELECT quantity, threshold FROM Ingredients WHERE id = ?", (item_id,))
-                quantity, threshold = cursor.fetchone()
+                index = catalog.ingredient_index.get(item_id)
+                if index is None:
+                    continue
+                quantity, threshold = catalog.quantities[index], catalog.thresholds[index]
+
+                if reorder_points is not None:
+                    threshold = float(reorder_points[index])
+                    self.ingredients_table.setItem(row, 6, QTableWidgetItem(str(threshold)))
+                else:
+                    self.ingredients_table.setItem(row, 6, QTableWidgetItem(""))
 
-                
                 if quantity < threshold:
                     for col in range(self.ingredients_table.columnCount()):
                         self.ingredients_table.item(row, col).setBackground(Qt.red)  # Highlight in red
@@ -185,17 +294,17 @@ class FoodBusinessApp(QWidget):
 
         
         item_id = int(self.ingredients_table.item(selected_row, 0).text())
+        self.load_ingredient_into_form(item_id)
 
+    def load_ingredient_into_form(self, item_id):
         # Fetch the existing data from the database
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT name, quantity, unit, cost_per_unit, threshold FROM Ingredients WHERE id = ?", (item_id,))
-            ingredient_data = cursor.fetchone()
-            if ingredient_data is None:
+            ingredient = self.db.ingredients.get(item_id)
+            if ingredient is None:
                 QMessageBox.warning(self, "Error", "Ingredient not found in database.")
                 return
 
-            name, quantity, unit, cost_per_unit, threshold = ingredient_data
+            _, name, quantity, unit, cost_per_unit, threshold, version = ingredient
 
             
             self.ingredient_name_edit.setText(name)
@@ -208,12 +317,12 @@ class FoodBusinessApp(QWidget):
             
             self.add_ingredient_button.setText("Update Ingredient")
             self.add_ingredient_button.clicked.disconnect() 
-            self.add_ingredient_button.clicked.connect(lambda: self.update_ingredient(item_id)) # Connect to a new function
+            self.add_ingredient_button.clicked.connect(lambda: self.update_ingredient(item_id, version)) # Connect to a new function
 
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
 
-    def update_ingredient(self, item_id):
+    def update_ingredient(self, item_id, version):
         
         name = self.ingredient_name_edit.text().strip()
         quantity_str = self.ingredient_quantity_edit.text().strip()
@@ -240,13 +349,14 @@ class FoodBusinessApp(QWidget):
 
         
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("""
-                UPDATE Ingredients
-                SET name = ?, quantity = ?, unit = ?, cost_per_unit = ?, threshold = ?
-                WHERE id = ?
-            """, (name, quantity, unit, cost_per_unit, threshold, item_id))
-            self.db_connection.commit()
+            # Only succeeds if nobody else has saved this ingredient since we loaded it
+            if not self.db.ingredients.update(item_id, version, name, quantity, unit, cost_per_unit, threshold):
+                QMessageBox.warning(self, "Conflict",
+                                    "This ingredient was changed or deleted by someone else. "
+                                    "The latest values have been loaded; please apply your edit again.")
+                self.load_ingredients()
+                self.load_ingredient_into_form(item_id)
+                return
             QMessageBox.information(self, "Success", "Ingredient updated successfully!")
             self.clear_ingredient_form()
             self.load_ingredients()  
@@ -278,9 +388,7 @@ class FoodBusinessApp(QWidget):
 
         
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("DELETE FROM Ingredients WHERE id = ?", (item_id,))
-            self.db_connection.commit()
+            self.db.ingredients.delete(item_id)
             QMessageBox.information(self, "Success", "Ingredient deleted successfully!")
             self.load_ingredients()  
         except sqlite3.Error as e:
@@ -322,10 +430,12 @@ class FoodBusinessApp(QWidget):
         self.add_recipe_button = QPushButton("Add Recipe")
         self.edit_recipe_button = QPushButton("Edit Recipe") 
         self.delete_recipe_button = QPushButton("Delete Recipe") 
+        self.import_menu_button = QPushButton("Import Menu...")
 
         button_layout.addWidget(self.add_recipe_button)
         button_layout.addWidget(self.edit_recipe_button)
         button_layout.addWidget(self.delete_recipe_button)
+        button_layout.addWidget(self.import_menu_button)
 
         
         self.recipes_table = QTableWidget()
@@ -347,6 +457,7 @@ class FoodBusinessApp(QWidget):
         self.add_recipe_button.clicked.connect(self.add_recipe)
         self.edit_recipe_button.clicked.connect(self.edit_recipe)
         self.delete_recipe_button.clicked.connect(self.delete_recipe)
+        self.import_menu_button.clicked.connect(self.import_menu)
         self.load_recipes()
         
         
@@ -362,9 +473,7 @@ class FoodBusinessApp(QWidget):
         
         ingredient_combo = QComboBox()
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT id, name FROM Ingredients")
-            ingredients = cursor.fetchall()
+            ingredients = self.db.catalog.ingredient_choices()
             for ingredient_id, ingredient_name in ingredients:
                 ingredient_combo.addItem(ingredient_name, ingredient_id)
         except sqlite3.Error as e:
@@ -387,11 +496,11 @@ class FoodBusinessApp(QWidget):
             
             current_ingredient_id = int(self.recipe_ingredients_table.item(selected_row, 0).text())
             
-            for i, ing in enumerate(self.current_recipe_ingredients):
-                if ing["id"] == current_ingredient_id:
+            for i, line in enumerate(self.current_recipe_ingredients):
+                if line.ingredient_id == current_ingredient_id:
                     
-                    ingredient_combo.setCurrentText(ing["name"]) 
-                    quantity_spinbox.setValue(ing["quantity"])
+                    ingredient_combo.setCurrentText(line.name) 
+                    quantity_spinbox.setValue(line.quantity)
                     editing_existing = True
                     existing_ingredient_index = i
                     break
@@ -406,23 +515,18 @@ class FoodBusinessApp(QWidget):
 
             if editing_existing:
                 # Update existing ingredient
-                self.current_recipe_ingredients[existing_ingredient_index]["quantity"] = quantity
-                
-                self.current_recipe_ingredients[existing_ingredient_index]["name"] = selected_ingredient_name
-                self.current_recipe_ingredients[existing_ingredient_index]["id"] = selected_ingredient_id
+                self.current_recipe_ingredients[existing_ingredient_index] = RecipeLine(
+                    selected_ingredient_id, selected_ingredient_name, quantity)
 
             else:
                 
-                for ingredient in self.current_recipe_ingredients:
-                    if ingredient["id"] == selected_ingredient_id:
+                for line in self.current_recipe_ingredients:
+                    if line.ingredient_id == selected_ingredient_id:
                         QMessageBox.warning(dialog, "Error", "This ingredient has already been added to the recipe.")  # Use dialog as parent
                         return
                 # Add new ingredient
-                self.current_recipe_ingredients.append({
-                    "id": selected_ingredient_id,
-                    "name": selected_ingredient_name,
-                    "quantity": quantity
-                })
+                self.current_recipe_ingredients.append(
+                    RecipeLine(selected_ingredient_id, selected_ingredient_name, quantity))
 
             self.update_recipe_ingredients_table()
             dialog.accept()
@@ -469,11 +573,11 @@ class FoodBusinessApp(QWidget):
     def update_recipe_ingredients_table(self):
         """Updates the table displaying the ingredients added to the recipe."""
         self.recipe_ingredients_table.setRowCount(0)  
-        for row_num, ingredient_data in enumerate(self.current_recipe_ingredients):
+        for row_num, line in enumerate(self.current_recipe_ingredients):
             self.recipe_ingredients_table.insertRow(row_num)
-            self.recipe_ingredients_table.setItem(row_num, 0, QTableWidgetItem(str(ingredient_data["id"])))
-            self.recipe_ingredients_table.setItem(row_num, 1, QTableWidgetItem(ingredient_data["name"]))
-            self.recipe_ingredients_table.setItem(row_num, 2, QTableWidgetItem(str(ingredient_data["quantity"])))
+            self.recipe_ingredients_table.setItem(row_num, 0, QTableWidgetItem(str(line.ingredient_id)))
+            self.recipe_ingredients_table.setItem(row_num, 1, QTableWidgetItem(line.name))
+            self.recipe_ingredients_table.setItem(row_num, 2, QTableWidgetItem(str(line.quantity)))
 
         
         self.recipe_ingredients_table.setSelectionBehavior(QTableWidget.SelectRows)
@@ -492,19 +596,9 @@ class FoodBusinessApp(QWidget):
             return
 
         try:
-            cursor = self.db_connection.cursor()
-            
-            cursor.execute("INSERT INTO Recipes (name, description) VALUES (?, ?)", (recipe_name, recipe_description))
-            recipe_id = cursor.lastrowid  
-
-            
-            for ingredient in self.current_recipe_ingredients:
-                cursor.execute("""
-                    INSERT INTO RecipeIngredients (recipe_id, ingredient_id, quantity_required)
-                    VALUES (?, ?, ?)
-                """, (recipe_id, ingredient["id"], ingredient["quantity"]))
-
-            self.db_connection.commit()
+            recipe_id = self.db.recipes.add(recipe_name, recipe_description,
+                                            [(line.ingredient_id, line.quantity) for line in self.current_recipe_ingredients])
+            self.result_cache.invalidate(("sales", recipe_id))
             QMessageBox.information(self, "Success", "Recipe added successfully!")
             self.clear_recipe_form()
             self.load_recipes()
@@ -523,43 +617,32 @@ class FoodBusinessApp(QWidget):
     
     def load_recipes(self):
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT id, name FROM Recipes")
-            recipes = cursor.fetchall()
+            recipes = self.db.catalog.recipe_choices()
+
+            costs = self.calculate_recipe_costs([recipe_id for recipe_id, _ in recipes])
 
             self.recipes_table.setRowCount(0)
             for row_num, (recipe_id, recipe_name) in enumerate(recipes):
                 self.recipes_table.insertRow(row_num)
                 self.recipes_table.setItem(row_num, 0, QTableWidgetItem(str(recipe_id)))
                 self.recipes_table.setItem(row_num, 1, QTableWidgetItem(recipe_name))
-
-                
-                total_cost = self.calculate_recipe_cost(recipe_id)
-                self.recipes_table.setItem(row_num, 2, QTableWidgetItem(str(total_cost)))
+                self.recipes_table.setItem(row_num, 2, QTableWidgetItem(str(costs[recipe_id])))
 
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
 
     def calculate_recipe_cost(self, recipe_id):
         """Calculates the total cost of a recipe."""
-        try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("""
-                SELECT ri.quantity_required, i.cost_per_unit
-                FROM RecipeIngredients ri
-                JOIN Ingredients i ON ri.ingredient_id = i.id
-                WHERE ri.recipe_id = ?
-            """, (recipe_id,))
-            ingredients = cursor.fetchall()
-
-            total_cost = 0
-            for quantity_required, cost_per_unit in ingredients:
-                total_cost += quantity_required * cost_per_unit
-            return round(total_cost, 2)
+        return self.calculate_recipe_costs([recipe_id])[recipe_id]
 
+    def calculate_recipe_costs(self, recipe_ids):
+        """Calculates the total cost of several recipes from the shared catalog snapshot."""
+        try:
+            catalog = self.db.catalog
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred during cost calculation: {e}")
-            return 0  
+            return {recipe_id: 0 for recipe_id in recipe_ids}
+        return {recipe_id: catalog.recipe_cost(recipe_id) for recipe_id in recipe_ids}
         
     def edit_recipe(self):
         selected_row = self.recipes_table.currentRow()
@@ -568,50 +651,36 @@ class FoodBusinessApp(QWidget):
             return
 
         recipe_id = int(self.recipes_table.item(selected_row, 0).text())
+        self.load_recipe_into_form(recipe_id)
 
+    def load_recipe_into_form(self, recipe_id):
         try:
-            cursor = self.db_connection.cursor()
             # Fetch recipe details
-            cursor.execute("SELECT name, description FROM Recipes WHERE id = ?", (recipe_id,))
-            recipe_data = cursor.fetchone()
+            recipe = self.db.recipes.get(recipe_id)
 
-            if recipe_data is None:
+            if recipe is None:
                  QMessageBox.warning(self, "Error", "Recipe not found in the database.")
                  return
 
-            recipe_name, recipe_description = recipe_data
+            _, recipe_name, recipe_description, version = recipe
 
             
             self.recipe_name_edit.setText(recipe_name)
             self.recipe_description_edit.setText(recipe_description)
 
             # Fetch and populate ingredients
-            self.current_recipe_ingredients = [] # Clear current ingredients
-            cursor.execute("""
-                SELECT i.id, i.name, ri.quantity_required
-                FROM RecipeIngredients ri
-                JOIN Ingredients i ON ri.ingredient_id = i.id
-                WHERE ri.recipe_id = ?
-            """, (recipe_id,))
-
-            ingredients = cursor.fetchall()
-            for ing_id, ing_name, quantity in ingredients:
-                self.current_recipe_ingredients.append({
-                    "id": ing_id,
-                    "name": ing_name,
-                    "quantity": quantity
-                })
+            self.current_recipe_ingredients = self.db.recipes.lines(recipe_id)
             self.update_recipe_ingredients_table()
 
             
             self.add_recipe_button.setText("Update Recipe")
             self.add_recipe_button.clicked.disconnect()
-            self.add_recipe_button.clicked.connect(lambda: self.update_recipe(recipe_id))
+            self.add_recipe_button.clicked.connect(lambda: self.update_recipe(recipe_id, version))
 
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
 
-    def update_recipe(self, recipe_id):
+    def update_recipe(self, recipe_id, version):
         recipe_name = self.recipe_name_edit.text().strip()
         recipe_description = self.recipe_description_edit.text().strip()
 
@@ -623,22 +692,17 @@ class FoodBusinessApp(QWidget):
             return
 
         try:
-            cursor = self.db_connection.cursor()
-            # Update Recipes table
-            cursor.execute("UPDATE Recipes SET name = ?, description = ? WHERE id = ?",
-                           (recipe_name, recipe_description, recipe_id))
-
-            # Delete old ingredients
-            cursor.execute("DELETE FROM RecipeIngredients WHERE recipe_id = ?", (recipe_id,))
-
-            # Insert updated ingredients
-            for ingredient in self.current_recipe_ingredients:
-                cursor.execute("""
-                    INSERT INTO RecipeIngredients (recipe_id, ingredient_id, quantity_required)
-                    VALUES (?, ?, ?)
-                """, (recipe_id, ingredient["id"], ingredient["quantity"]))
-
-            self.db_connection.commit()
+            # Update the recipe and its ingredients, unless someone else saved the recipe since we loaded it
+            lines = [(line.ingredient_id, line.quantity) for line in self.current_recipe_ingredients]
+            if not self.db.recipes.update(recipe_id, version, recipe_name, recipe_description, lines):
+                QMessageBox.warning(self, "Conflict",
+                                    "This recipe was changed or deleted by someone else. "
+                                    "The latest version has been loaded; please apply your edit again.")
+                self.load_recipes()
+                self.load_recipe_into_form(recipe_id)
+                return
+
+            self.reorder_planner.invalidate()  # Past consumption is derived from the recipe
             QMessageBox.information(self, "Success", "Recipe updated successfully!")
             self.clear_recipe_form()
             self.load_recipes()
@@ -666,27 +730,41 @@ class FoodBusinessApp(QWidget):
         recipe_id = int(self.recipes_table.item(selected_row, 0).text())
 
         try:
-            cursor = self.db_connection.cursor()
-            
-            cursor.execute("DELETE FROM RecipeIngredients WHERE recipe_id = ?", (recipe_id,))
-            
-            cursor.execute("DELETE FROM Recipes WHERE id = ?", (recipe_id,))
-
-            self.db_connection.commit()
+            self.db.recipes.delete(recipe_id)
+            self.result_cache.invalidate(("sales", recipe_id))
+            self.reorder_planner.invalidate()
             QMessageBox.information(self, "Success", "Recipe deleted successfully!")
             self.load_recipes()
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
 
+    def import_menu(self):
+        """Imports recipes from a JSON or CSV file in a single transaction."""
+        path, _ = QFileDialog.getOpenFileName(self, "Import Menu", "", "Menu files (*.json *.csv)")
+        if not path:
+            return
+
+        try:
+            recipe_ids = import_menu(self.db, read_menu_file(path))
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Import Error", f"Could not import {path}: {e}")
+            return
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+            return
+
+        self.reorder_planner.invalidate()
+        QMessageBox.information(self, "Success", f"Imported {len(recipe_ids)} recipes.")
+        self.load_recipes()
+        self.populate_recipe_combobox()
+        self.load_predictions()
+
         
     def populate_recipe_combobox(self):
         """Populates the recipe QComboBox with data from the Recipes table."""
         self.sales_recipe_combo.clear()  
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT id, name FROM Recipes")
-            recipes = cursor.fetchall()
-            for recipe_id, recipe_name in recipes:
+            for recipe_id, recipe_name in self.db.catalog.recipe_choices():
                 self.sales_recipe_combo.addItem(recipe_name, recipe_id)  
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
@@ -706,10 +784,14 @@ class FoodBusinessApp(QWidget):
         self.sales_quantity_spinbox.setMinimum(0.01)
         self.sales_quantity_spinbox.setValue(1.0)
         self.sales_quantity_spinbox.setSingleStep(0.1)
+        self.sales_price_spinbox = QDoubleSpinBox()
+        self.sales_price_spinbox.setMaximum(1000000.0)
+        self.sales_price_spinbox.setToolTip("What one unit sold for; used to estimate how price affects demand.")
 
         form_layout.addRow("Date:", self.sales_date_edit)
         form_layout.addRow("Recipe:", self.sales_recipe_combo)
         form_layout.addRow("Quantity Sold:", self.sales_quantity_spinbox)
+        form_layout.addRow("Unit Price:", self.sales_price_spinbox)
 
         
         add_entry_button = QPushButton("Add Sales Entry")
@@ -717,14 +799,21 @@ class FoodBusinessApp(QWidget):
 
         
         self.sales_history_table = QTableWidget()
-        self.sales_history_table.setColumnCount(4)  # ID, Date, Recipe, Quantity
-        self.sales_history_table.setHorizontalHeaderLabels(["ID", "Date", "Recipe", "Quantity"])
+        self.sales_history_table.setColumnCount(7)  # ID, Date, Recipe, Quantity, Unit Price, Flagged, Location
+        self.sales_history_table.setHorizontalHeaderLabels(["ID", "Date", "Recipe", "Quantity", "Unit Price",
+                                                            "Flagged", "Location"])
         self.sales_history_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.sales_history_table.setSelectionBehavior(QTableWidget.SelectRows)
+
+        toggle_flag_button = QPushButton("Toggle Outlier Flag")
+        toggle_flag_button.setToolTip("Flagged sales can be left out of demand predictions.")
+        toggle_flag_button.clicked.connect(self.toggle_sale_flag)
 
          
         layout.addLayout(form_layout)
         layout.addWidget(add_entry_button)
         layout.addWidget(self.sales_history_table)
+        layout.addWidget(toggle_flag_button)
         self.sales_tab.setLayout(layout)
 
         # Load Data
@@ -734,9 +823,10 @@ class FoodBusinessApp(QWidget):
 
     def add_sales_entry(self):
         """Adds a new sales entry to the SalesHistory table."""
-        sale_date = self.sales_date_edit.date().toString(Qt.ISODate)  
+        sale_day = self.sales_date_edit.date().toJulianDay()  # Stored as an integer day number
         recipe_id = self.sales_recipe_combo.currentData()  
         quantity_sold = self.sales_quantity_spinbox.value()
+        unit_price = self.sales_price_spinbox.value()
 
         if not recipe_id:
             QMessageBox.warning(self, "Error", "Please select a recipe.")
@@ -746,18 +836,25 @@ class FoodBusinessApp(QWidget):
             return
 
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("""
-                INSERT INTO SalesHistory (sale_date, recipe_id, quantity_sold)
-                VALUES (?, ?, ?)
-            """, (sale_date, recipe_id, quantity_sold))
-
-            # Deduct Ingredients
-            self.deduct_ingredients(recipe_id, quantity_sold)
-
-            self.db_connection.commit()
+            # Records the sale and deducts its ingredients in one transaction
+            _, consumption, shortages, flagged = self.db.sales.record(recipe_id, sale_day, quantity_sold,
+                                                                      unit_price)
+            for shortage in shortages:
+                QMessageBox.warning(self, "Insufficient Inventory",
+                                    f"Not enough {shortage.name} in stock to fulfill the order.\n"
+                                    f"Available: {shortage.available}, Required: {shortage.required}")
+            if flagged:
+                QMessageBox.warning(self, "Unusual Quantity",
+                                    f"{quantity_sold} is far outside this recipe's usual sales and was flagged.\n"
+                                    "Check it for a typo; flagged sales can be left out of demand predictions.")
+
+            # Stock levels changed, but costs didn't; only this recipe's demand is stale
+            self.result_cache.invalidate(("sales", recipe_id))
+            if not flagged:  # Outliers stay out of the consumption statistics
+                self.reorder_planner.record_consumption(sale_day, consumption)
             QMessageBox.information(self, "Success", "Sales entry added successfully!")
             self.load_sales_history()  
+            self.load_trends()
             # self.clear_sales_form()  # might want a function to clear the form
             self.update_low_stock_indicators()  # Update low stock indicators
             self.load_ingredients() 
@@ -766,81 +863,60 @@ class FoodBusinessApp(QWidget):
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
     
 
+    def fill_sale_price(self):
+        """Defaults the unit price of a new sale to the selected recipe's suggested price."""
+        recipe_id = self.sales_recipe_combo.currentData()
+        if recipe_id:
+            self.sales_price_spinbox.setValue(self.calculate_suggested_price(recipe_id))
+
     def load_sales_history(self):
         """Loads and displays the sales history in the table."""
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("""
-                SELECT sh.id, sh.sale_date, r.name, sh.quantity_sold
-                FROM SalesHistory sh
-                JOIN Recipes r ON sh.recipe_id = r.id
-                ORDER BY sh.sale_date DESC
-            """)  # Added ORDER BY
-            sales_data = cursor.fetchall()
+            self.sales_data = self.db.sales.history()
 
             self.sales_history_table.setRowCount(0)  
-            for row_num, (sale_id, sale_date, recipe_name, quantity_sold) in enumerate(sales_data):
+            for row_num, (sale_id, sale_day, _, recipe_name, quantity_sold, unit_price, flagged, _,
+                          location_name) in enumerate(self.sales_data):
                 self.sales_history_table.insertRow(row_num)
                 self.sales_history_table.setItem(row_num, 0, QTableWidgetItem(str(sale_id)))
+                sale_date = QDate.fromJulianDay(sale_day).toString(Qt.ISODate)
                 self.sales_history_table.setItem(row_num, 1, QTableWidgetItem(sale_date))
                 self.sales_history_table.setItem(row_num, 2, QTableWidgetItem(recipe_name))
                 self.sales_history_table.setItem(row_num, 3, QTableWidgetItem(str(quantity_sold)))
+                self.sales_history_table.setItem(row_num, 4, QTableWidgetItem(
+                    "" if unit_price is None else f"{unit_price:.2f}"))  # Not recorded for older sales
+                self.sales_history_table.setItem(row_num, 5, QTableWidgetItem("Yes" if flagged else ""))
+                self.sales_history_table.setItem(row_num, 6, QTableWidgetItem(location_name))
 
                 # Make ID column read-only.
                 item = QTableWidgetItem(str(sale_id))
                 item.setFlags(item.flags() & ~Qt.ItemIsEditable)
                 self.sales_history_table.setItem(row_num, 0, item)
 
+                if flagged:
+                    for col in range(self.sales_history_table.columnCount()):
+                        self.sales_history_table.item(row_num, col).setBackground(Qt.yellow)
+
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
     
 
 
-    def deduct_ingredients(self, recipe_id, quantity_sold):
-        """Deducts ingredients from inventory based on a recipe and quantity sold."""
+    def toggle_sale_flag(self):
+        """Flags the selected sale as an outlier, or clears its flag."""
+        row = self.sales_history_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "Error", "Please select a sale.")
+            return
+        sale = self.sales_data[row]
         try:
-            cursor = self.db_connection.cursor()
-
-            
-            cursor.execute("""
-                SELECT ingredient_id, quantity_required
-                FROM RecipeIngredients
-                WHERE recipe_id = ?
-            """, (recipe_id,))
-            ingredients = cursor.fetchall()
-
-            for ingredient_id, quantity_required in ingredients:
-                # Calculate the total quantity of the ingredient needed
-                total_quantity_needed = quantity_required * quantity_sold
-
-                # Get the current quantity of the ingredient
-                cursor.execute("SELECT quantity FROM Ingredients WHERE id = ?", (ingredient_id,))
-                current_quantity = cursor.fetchone()[0]
-
-                # Check if there's enough of the ingredient
-                if current_quantity < total_quantity_needed:
-                    cursor.execute("SELECT name FROM Ingredients WHERE id = ?", (ingredient_id,))
-                    ingredient_name = cursor.fetchone()[0]
-                    QMessageBox.warning(self, "Insufficient Inventory",
-                                        f"Not enough {ingredient_name} in stock to fulfill the order.\n"
-                                        f"Available: {current_quantity}, Required: {total_quantity_needed}")
-                    
-                    continue  # Skip to the next ingredient
-
-                # Deduct the quantity from the inventory
-                new_quantity = current_quantity - total_quantity_needed
-                cursor.execute("UPDATE Ingredients SET quantity = ? WHERE id = ?", (new_quantity, ingredient_id))
-
-            
-
+            self.db.sales.set_flagged(sale, not sale.flagged)
+            self.result_cache.invalidate(("sales", sale.recipe_id))
+            self.reorder_planner.invalidate()
+            self.load_sales_history()
+            self.load_predictions()
         except sqlite3.Error as e:
-            
-            self.db_connection.rollback()
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
-            raise  
-    
-
-
 
     def setup_predictions_tab(self):
         # Layout
@@ -854,6 +930,11 @@ class FoodBusinessApp(QWidget):
         controls_layout.addWidget(QLabel("Prediction Period:"))
         controls_layout.addWidget(self.prediction_period_combo)
 
+        self.exclude_flagged_checkbox = QCheckBox("Exclude flagged sales")
+        self.exclude_flagged_checkbox.setToolTip("Leave sales flagged as outliers out of the predicted demand.")
+        self.exclude_flagged_checkbox.toggled.connect(self.load_predictions)
+        controls_layout.addWidget(self.exclude_flagged_checkbox)
+
         self.profit_margin_spinbox = QDoubleSpinBox()
         self.profit_margin_spinbox.setMinimum(0.0)
         self.profit_margin_spinbox.setMaximum(100.0)  # Percentage
@@ -869,10 +950,21 @@ class FoodBusinessApp(QWidget):
         self.refresh_predictions_button.clicked.connect(self.load_predictions)
         controls_layout.addWidget(self.refresh_predictions_button)
 
+        self.price_scenarios_button = QPushButton("Price Scenarios...")
+        self.price_scenarios_button.clicked.connect(self.show_price_scenarios_dialog)
+        controls_layout.addWidget(self.price_scenarios_button)
+
         # Table 
         self.predictions_table = QTableWidget()
-        self.predictions_table.setColumnCount(5)  # ID, Recipe, Cost, Predicted Demand, Suggested Price
-        self.predictions_table.setHorizontalHeaderLabels(["ID", "Recipe", "Cost", "Predicted Demand", "Suggested Price"])
+        # ID, Recipe, Cost, Predicted Demand, Suggested Price, Price Elasticity, Profit-Maximizing Price
+        self.predictions_table.setColumnCount(7)
+        self.predictions_table.setHorizontalHeaderLabels(["ID", "Recipe", "Cost", "Predicted Demand", "Suggested Price",
+                                                          "Price Elasticity", "Profit-Maximizing Price"])
+        self.predictions_table.horizontalHeaderItem(5).setToolTip(
+            "% change in daily sales per 1% price change, fitted on recorded sale prices.")
+        self.predictions_table.horizontalHeaderItem(6).setToolTip(
+            "Price with the highest expected profit under the fitted demand curve, "
+            "within the range of prices charged so far.")
         self.predictions_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
         #Add to Layout
@@ -887,9 +979,16 @@ class FoodBusinessApp(QWidget):
     def load_predictions(self):
         """Loads and displays recipe predictions and pricing."""
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT id, name FROM Recipes")
-            recipes = cursor.fetchall()
+            recipes = self.db.catalog.recipe_choices()
+
+            recipe_ids = [recipe_id for recipe_id, _ in recipes]
+            costs = self.calculate_recipe_costs(recipe_ids)
+            demands = self.calculate_predicted_demands(recipe_ids)
+            curves = self.calculate_demand_curves(recipe_ids)
+            best_prices = profit_maximizing_prices([costs[recipe_id] for recipe_id in recipe_ids],
+                                                   [curves[recipe_id].elasticity for recipe_id in recipe_ids],
+                                                   [curves[recipe_id].min_price for recipe_id in recipe_ids],
+                                                   [curves[recipe_id].max_price for recipe_id in recipe_ids])
 
             self.predictions_table.setRowCount(0)  
             for row_num, (recipe_id, recipe_name) in enumerate(recipes):
@@ -902,17 +1001,25 @@ class FoodBusinessApp(QWidget):
                 self.predictions_table.setItem(row_num, 1, QTableWidgetItem(recipe_name))
 
                 # Cost
-                cost = self.calculate_recipe_cost(recipe_id)
+                cost = costs[recipe_id]
                 self.predictions_table.setItem(row_num, 2, QTableWidgetItem(str(cost)))
 
                 # Predicted Demand
-                predicted_demand = self.calculate_predicted_demand(recipe_id)
+                predicted_demand = demands[recipe_id]
                 self.predictions_table.setItem(row_num, 3, QTableWidgetItem(str(predicted_demand)))
 
                 # Suggested Price
                 suggested_price = self.calculate_suggested_price(recipe_id)
                 self.predictions_table.setItem(row_num, 4, QTableWidgetItem(str(suggested_price)))
 
+                # Demand-aware pricing; blank until there are enough priced sales to fit
+                elasticity = curves[recipe_id].elasticity
+                self.predictions_table.setItem(row_num, 5, QTableWidgetItem(
+                    "" if math.isnan(elasticity) else f"{elasticity:.2f}"))
+                best_price = best_prices[row_num]
+                self.predictions_table.setItem(row_num, 6, QTableWidgetItem(
+                    "" if math.isnan(best_price) else f"{best_price:.2f}"))
+
 
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
@@ -921,53 +1028,73 @@ class FoodBusinessApp(QWidget):
 
     def calculate_predicted_demand(self, recipe_id):
         """Calculates the predicted demand for a recipe using a simple moving average."""
-        try:
-            cursor = self.db_connection.cursor()
-
-            # Get the selected prediction period
-            period_text = self.prediction_period_combo.currentText()
-            if period_text == "Last 7 Days":
-                days = 7
-            elif period_text == "Last 30 Days":
-                days = 30
-            elif period_text == "Last 90 Days":
-                days = 90
-            else:
-                days = 7  # Default to 7 days
-
-            # Calculate the date 'days' days ago
-            start_date = QDate.currentDate().addDays(-days)
-            start_date_str = start_date.toString(Qt.ISODate)
-
-
-            # Fetch sales history for the recipe within the time period
-            cursor.execute("""
-                SELECT sale_date, quantity_sold
-                FROM SalesHistory
-                WHERE recipe_id = ? AND sale_date >= ?
-                ORDER BY sale_date
-            """, (recipe_id, start_date_str))
-
-            sales_data = cursor.fetchall()
+        return self.calculate_predicted_demands([recipe_id])[recipe_id]
+
+    def calculate_predicted_demands(self, recipe_ids):
+        """Calculates the predicted demand for several recipes, querying only those not already cached."""
+        # Get the selected prediction period
+        period_text = self.prediction_period_combo.currentText()
+        if period_text == "Last 7 Days":
+            days = 7
+        elif period_text == "Last 30 Days":
+            days = 30
+        elif period_text == "Last 90 Days":
+            days = 90
+        else:
+            days = 7  # Default to 7 days
+
+        # Calculate the day number 'days' days ago
+        start_day = QDate.currentDate().addDays(-days).toJulianDay()
+        exclude_flagged = self.exclude_flagged_checkbox.isChecked()
 
+        try:
+            demands = self.result_cache.get_many(
+                "predicted_demand", [(recipe_id, start_day, days, exclude_flagged) for recipe_id in recipe_ids],
+                PREDICTED_DEMAND_TABLES, self._query_predicted_demands)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred during demand prediction: {e}")
+            return {recipe_id: 0 for recipe_id in recipe_ids}
+        return {key[0]: demand for key, demand in demands.items()}
+
+    def _query_predicted_demands(self, keys):
+        """Returns {(recipe_id, start_day, days, exclude_flagged): (demand, cache tags)} for keys sharing one period."""
+        _, start_day, days, exclude_flagged = keys[0]
+        recipe_ids = [key[0] for key in keys]
+        # Sum sales per recipe within the time period
+        totals = self.db.sales.demand_totals(recipe_ids, start_day, exclude_flagged)
+
+        results = {}
+        for recipe_id in recipe_ids:
+            total_sold = totals.get(recipe_id)
             # Calculate the moving average
-            if not sales_data:
-                return 0 
-
-            total_sold = 0
-            for _, quantity_sold in sales_data:
-                total_sold += quantity_sold
-
-            average_daily_sales = total_sold / days #Could be 0 if days between first and last sale is 0
-            predicted_demand = round(average_daily_sales * days, 2) 
+            if not total_sold:
+                predicted_demand = 0
+            else:
+                average_daily_sales = total_sold / days
+                predicted_demand = round(average_daily_sales * days, 2)
+            results[(recipe_id, start_day, days, exclude_flagged)] = (predicted_demand, {("sales", recipe_id)})
+        return results
+    
 
-            return predicted_demand
 
+    def calculate_demand_curves(self, recipe_ids):
+        """Fits each recipe's price elasticity on recent priced sales, fitting only those not already cached."""
+        start_day = QDate.currentDate().addDays(-PRICING_WINDOW_DAYS).toJulianDay()
+        try:
+            curves = self.result_cache.get_many(
+                "demand_curve", [(recipe_id, start_day) for recipe_id in recipe_ids],
+                PREDICTED_DEMAND_TABLES, self._fit_demand_curves)
         except sqlite3.Error as e:
-            QMessageBox.critical(self, "Database Error", f"An error occurred during demand prediction: {e}")
-            return 0
-    
+            QMessageBox.critical(self, "Database Error", f"An error occurred during price fitting: {e}")
+            curves = {(recipe_id, start_day): DemandCurve(math.nan, math.nan, 0, math.nan, math.nan)
+                      for recipe_id in recipe_ids}
+        return {key[0]: curve for key, curve in curves.items()}
 
+    def _fit_demand_curves(self, keys):
+        """Returns {(recipe_id, start_day): (DemandCurve, cache tags)}, fitting every missing recipe at once."""
+        start_day = keys[0][1]
+        curves = fit_recipes(self.db, [key[0] for key in keys], start_day)
+        return {(recipe_id, start_day): (curve, {("sales", recipe_id)}) for recipe_id, curve in curves.items()}
 
     def calculate_suggested_price(self, recipe_id):
         """Calculates the suggested price based on cost and profit margin."""
@@ -982,8 +1109,342 @@ class FoodBusinessApp(QWidget):
 
 
 
+    def show_price_scenarios_dialog(self):
+        """Shows a what-if dialog: how ingredient price changes would move every recipe's suggested price."""
+        try:
+            cost_model = CostModel.from_db(self.db)  # Snapshot; scenarios never write to the database
+            ingredient_names = self.db.catalog.ingredient_choices()
+            recipe_names = dict(self.db.catalog.recipe_choices())
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+            return
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Ingredient Price Scenarios")
+        dialog.resize(900, 600)
+        dialog_layout = QVBoxLayout(dialog)
+
+        # Shocks: rows sharing a scenario name are applied together
+        dialog_layout.addWidget(QLabel("Price changes (rows with the same scenario name are combined):"))
+        shocks_table = QTableWidget(0, 3)
+        shocks_table.setHorizontalHeaderLabels(["Scenario", "Ingredient", "Change %"])
+        shocks_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        dialog_layout.addWidget(shocks_table)
+
+        # One ingredient list shared by every picker, instead of a copy per row
+        ingredient_model = QStandardItemModel(dialog)
+        for ing_id, ing_name in ingredient_names:
+            item = QStandardItem(ing_name)
+            item.setData(ing_id, Qt.UserRole)
+            ingredient_model.appendRow(item)
+
+        def add_shock_row(scenario_name):
+            row = shocks_table.rowCount()
+            shocks_table.insertRow(row)
+            shocks_table.setItem(row, 0, QTableWidgetItem(scenario_name))
+            ingredient_combo = QComboBox()
+            ingredient_combo.setModel(ingredient_model)
+            shocks_table.setCellWidget(row, 1, ingredient_combo)
+            change_spinbox = QDoubleSpinBox()
+            change_spinbox.setRange(-100.0, 1000.0)
+            change_spinbox.setSuffix("%")
+            shocks_table.setCellWidget(row, 2, change_spinbox)
+
+        shock_buttons = QHBoxLayout()
+        add_shock_button = QPushButton("Add Change")
+        remove_shock_button = QPushButton("Remove Change")
+        sweep_spinbox = QDoubleSpinBox()
+        sweep_spinbox.setRange(-100.0, 1000.0)
+        sweep_spinbox.setSuffix("%")
+        sweep_spinbox.setValue(10.0)
+        sweep_button = QPushButton("Add One Scenario per Ingredient")
+        run_button = QPushButton("Run Scenarios")
+        shock_buttons.addWidget(add_shock_button)
+        shock_buttons.addWidget(remove_shock_button)
+        shock_buttons.addWidget(sweep_spinbox)
+        shock_buttons.addWidget(sweep_button)
+        shock_buttons.addWidget(run_button)
+        dialog_layout.addLayout(shock_buttons)
+
+        # Results: one column per scenario, "new price (delta vs live price)"
+        results_note = QLabel()
+        dialog_layout.addWidget(results_note)
+        results_table = QTableWidget()
+        dialog_layout.addWidget(results_table)
+
+        def handle_add_shock():
+            add_shock_row(f"Scenario {shocks_table.rowCount() + 1}")
+
+        def handle_remove_shock():
+            if shocks_table.currentRow() != -1:
+                shocks_table.removeRow(shocks_table.currentRow())
+
+        def handle_sweep():
+            # Plain items rather than a picker and spin box per row, so thousands of rows stay quick
+            percent_change = sweep_spinbox.value()
+            first_row = shocks_table.rowCount()
+            shocks_table.setUpdatesEnabled(False)
+            shocks_table.setRowCount(first_row + len(ingredient_names))
+            for row, (ing_id, ing_name) in enumerate(ingredient_names, start=first_row):
+                shocks_table.setItem(row, 0, QTableWidgetItem(f"{ing_name} {percent_change:+g}%"))
+                ingredient_item = QTableWidgetItem(ing_name)
+                ingredient_item.setData(Qt.UserRole, ing_id)
+                ingredient_item.setFlags(ingredient_item.flags() & ~Qt.ItemIsEditable)
+                shocks_table.setItem(row, 1, ingredient_item)
+                shocks_table.setItem(row, 2, QTableWidgetItem(f"{percent_change:g}"))
+            shocks_table.setUpdatesEnabled(True)
+
+        def handle_run():
+            scenarios = {}
+            for row in range(shocks_table.rowCount()):
+                name_item = shocks_table.item(row, 0)
+                scenario_name = name_item.text().strip() if name_item else ""
+                ingredient_combo = shocks_table.cellWidget(row, 1)
+                if ingredient_combo is not None:
+                    ingredient_id = ingredient_combo.currentData()
+                    percent_change = shocks_table.cellWidget(row, 2).value()
+                else:  # A sweep row
+                    ingredient_id = shocks_table.item(row, 1).data(Qt.UserRole)
+                    try:
+                        percent_change = float(shocks_table.item(row, 2).text().rstrip("%"))
+                    except ValueError:
+                        percent_change = math.nan
+                    if not -100.0 <= percent_change <= 1000.0:
+                        QMessageBox.warning(dialog, "Error",
+                                            f"Row {row + 1}: the change must be a number from -100 to 1000.")
+                        return
+                scenarios.setdefault(scenario_name or f"Scenario {row + 1}", {})[ingredient_id] = \
+                    1 + percent_change / 100.0
+            if not scenarios:
+                QMessageBox.warning(dialog, "Error", "Please add at least one price change.")
+                return
+
+            profit_margin = self.profit_margin_spinbox.value() / 100.0
+            # Every scenario at once: line costs under each scenario, summed per recipe
+            prices = cost_model.suggested_prices(list(scenarios.values()), profit_margin)
+            names = list(scenarios)
+            shown = range(len(names))
+            if len(names) > MAX_SCENARIO_COLUMNS:
+                # Only the scenarios with the largest average price change get a column
+                base_prices = cost_model.suggested_prices([{}], profit_margin)
+                impact = abs(prices - base_prices).mean(axis=0)
+                shown = impact.argsort(kind="stable")[::-1][:MAX_SCENARIO_COLUMNS]
+                results_note.setText(f"Showing the {MAX_SCENARIO_COLUMNS} of {len(names)} scenarios "
+                                     "that change prices most.")
+            else:
+                results_note.setText("")
+
+            results_table.clear()
+            results_table.setColumnCount(2 + len(shown))
+            results_table.setHorizontalHeaderLabels(["Recipe", "Live Price"] + [names[col] for col in shown])
+            results_table.setRowCount(len(cost_model.recipe_ids))
+            for row, recipe_id in enumerate(cost_model.recipe_ids):
+                live_price = self.calculate_suggested_price(recipe_id)
+                results_table.setItem(row, 0, QTableWidgetItem(recipe_names.get(recipe_id, str(recipe_id))))
+                results_table.setItem(row, 1, QTableWidgetItem(str(live_price)))
+                for col, scenario in enumerate(shown):
+                    new_price = float(prices[row, scenario])
+                    results_table.setItem(row, 2 + col,
+                                          QTableWidgetItem(f"{new_price:.2f} ({new_price - live_price:+.2f})"))
+
+        add_shock_button.clicked.connect(handle_add_shock)
+        remove_shock_button.clicked.connect(handle_remove_shock)
+        sweep_button.clicked.connect(handle_sweep)
+        run_button.clicked.connect(handle_run)
+
+        dialog.exec_()
+
+    def setup_trends_tab(self):
+        layout = QVBoxLayout()
+
+        # Controls (Recipe, Bucket size and Metric)
+        controls_layout = QHBoxLayout()
+
+        self.trend_recipe_combo = QComboBox()
+        controls_layout.addWidget(QLabel("Recipe:"))
+        controls_layout.addWidget(self.trend_recipe_combo)
+
+        self.trend_bucket_combo = QComboBox()
+        for bucket in BUCKETS:
+            self.trend_bucket_combo.addItem(bucket.capitalize(), bucket)
+        controls_layout.addWidget(QLabel("Group By:"))
+        controls_layout.addWidget(self.trend_bucket_combo)
+
+        self.trend_metric_combo = QComboBox()
+        self.trend_metric_combo.addItems(["Units Sold", "Revenue"])
+        self.trend_metric_combo.setToolTip("Revenue is units sold x the price they sold at; sales recorded "
+                                           "without a price use the current suggested price.")
+        controls_layout.addWidget(QLabel("Show:"))
+        controls_layout.addWidget(self.trend_metric_combo)
+
+        # Chart (wheel to zoom, drag to pan, double-click to reset)
+        self.trend_chart = TrendChart()
+
+        layout.addLayout(controls_layout)
+        layout.addWidget(self.trend_chart)
+        self.trends_tab.setLayout(layout)
+
+        self.trends_stale = True  # Loaded when the tab is first shown
+        self.populate_trend_recipe_combobox()
+        self.trend_recipe_combo.currentIndexChanged.connect(self.load_trends)
+        self.trend_bucket_combo.currentIndexChanged.connect(self.load_trends)
+        self.trend_metric_combo.currentIndexChanged.connect(self.load_trends)
+
+    def populate_trend_recipe_combobox(self):
+        """Fills the trend recipe picker, keeping the current selection if it still exists."""
+        selected = self.trend_recipe_combo.currentData()
+        self.trend_recipe_combo.blockSignals(True)
+        self.trend_recipe_combo.clear()
+        self.trend_recipe_combo.addItem("All Recipes", None)
+        try:
+            for recipe_id, recipe_name in self.db.catalog.recipe_choices():
+                self.trend_recipe_combo.addItem(recipe_name, recipe_id)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+        self.trend_recipe_combo.setCurrentIndex(max(self.trend_recipe_combo.findData(selected), 0))
+        self.trend_recipe_combo.blockSignals(False)
+
+    def load_trends(self):
+        """Aggregates sales per day/week/month in SQL and hands the series to the chart.
+
+        While the Sales Trends tab is hidden this only marks the chart stale;
+        it is loaded when the tab is shown.
+        """
+        if self.tabs.currentWidget() is not self.trends_tab:
+            self.trends_stale = True
+            return
+        self.trends_stale = False
+        recipe_id = self.trend_recipe_combo.currentData()
+        bucket = self.trend_bucket_combo.currentData()
+        try:
+            rows = self.db.sales.trend(bucket, recipe_id)
+            # The suggested price only stands in for sales recorded without one
+            recipe_ids = sorted({row[1] for row in rows if row[3]})
+            prices = {rid: self.calculate_suggested_price(rid) for rid in recipe_ids}
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+            return
+
+        days, units, revenue = build_series(rows, prices)
+        metric = self.trend_metric_combo.currentText()
+        values = units if metric == "Units Sold" else revenue
+        label = f"{metric} per {bucket} - {self.trend_recipe_combo.currentText()}"
+        self.trend_chart.set_series(days, values, label)
+
+    def setup_lots_tab(self):
+        layout = QVBoxLayout()
+
+        # Form Layout (for receiving a delivery as a new lot)
+        form_layout = QFormLayout()
+
+        self.lot_ingredient_combo = QComboBox()
+        self.lot_quantity_spinbox = QDoubleSpinBox()
+        self.lot_quantity_spinbox.setRange(0.01, 1e9)
+        self.lot_quantity_spinbox.setValue(1.0)
+        self.lot_received_date_edit = QDateEdit(calendarPopup=True)
+        self.lot_received_date_edit.setDate(QDate.currentDate())
+        self.lot_expiry_date_edit = QDateEdit(calendarPopup=True)
+        self.lot_expiry_date_edit.setDate(QDate.currentDate().addDays(EXPIRING_WITHIN_DAYS))
+        self.lot_no_expiry_checkbox = QCheckBox("Does not expire")
+        self.lot_no_expiry_checkbox.toggled.connect(lambda checked: self.lot_expiry_date_edit.setEnabled(not checked))
+
+        form_layout.addRow("Ingredient:", self.lot_ingredient_combo)
+        form_layout.addRow("Quantity:", self.lot_quantity_spinbox)
+        form_layout.addRow("Received:", self.lot_received_date_edit)
+        form_layout.addRow("Expires:", self.lot_expiry_date_edit)
+        form_layout.addRow("", self.lot_no_expiry_checkbox)
+
+        receive_button = QPushButton("Receive Stock")
+        receive_button.clicked.connect(self.receive_stock)
+
+        # Expiring lots, soonest first
+        controls_layout = QHBoxLayout()
+        self.expiring_days_spinbox = QSpinBox()
+        self.expiring_days_spinbox.setRange(0, 365)
+        self.expiring_days_spinbox.setValue(EXPIRING_WITHIN_DAYS)
+        self.expiring_days_spinbox.setSuffix(" days")
+        self.expiring_days_spinbox.valueChanged.connect(self.load_expiring_lots)
+        controls_layout.addWidget(QLabel("Expiring Within:"))
+        controls_layout.addWidget(self.expiring_days_spinbox)
+        controls_layout.addStretch()
+
+        self.lots_table = QTableWidget()
+        self.lots_table.setColumnCount(5)  # Lot, Ingredient, Received, Expires, Remaining
+        self.lots_table.setHorizontalHeaderLabels(["Lot", "Ingredient", "Received", "Expires", "Remaining"])
+        self.lots_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.lots_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        layout.addLayout(form_layout)
+        layout.addWidget(receive_button)
+        layout.addLayout(controls_layout)
+        layout.addWidget(self.lots_table)
+        self.lots_tab.setLayout(layout)
+
+        self.populate_lot_ingredient_combobox()
+        self.load_expiring_lots()
+
+    def populate_lot_ingredient_combobox(self):
+        """Fills the ingredient picker, keeping the current selection if it still exists."""
+        selected = self.lot_ingredient_combo.currentData()
+        self.lot_ingredient_combo.clear()
+        try:
+            for ingredient_id, ingredient_name in self.db.catalog.ingredient_choices():
+                self.lot_ingredient_combo.addItem(ingredient_name, ingredient_id)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+        self.lot_ingredient_combo.setCurrentIndex(max(self.lot_ingredient_combo.findData(selected), 0))
+
+    def receive_stock(self):
+        """Books a delivery as a new lot and adds it to the ingredient's stock."""
+        ingredient_id = self.lot_ingredient_combo.currentData()
+        quantity = self.lot_quantity_spinbox.value()
+        received_day = self.lot_received_date_edit.date().toJulianDay()
+        if self.lot_no_expiry_checkbox.isChecked():
+            expiry_day = db_setup.NO_EXPIRY_DAY
+        else:
+            expiry_day = self.lot_expiry_date_edit.date().toJulianDay()
+
+        if not ingredient_id:
+            QMessageBox.warning(self, "Error", "Please select an ingredient.")
+            return
+        if expiry_day < received_day:
+            QMessageBox.warning(self, "Error", "Expiry date cannot be before the received date.")
+            return
+
+        try:
+            self.db.lots.receive(ingredient_id, quantity, received_day, expiry_day)
+            # Stock levels changed, but costs and demand didn't
+            QMessageBox.information(self, "Success", "Stock received successfully!")
+            self.load_expiring_lots()
+            self.update_low_stock_indicators()
+            self.load_ingredients()
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+
+    def load_expiring_lots(self):
+        """Lists open lots that expire within the chosen number of days (includes already expired ones)."""
+        until_day = QDate.currentDate().addDays(self.expiring_days_spinbox.value()).toJulianDay()
+        try:
+            lots = self.db.lots.expiring(until_day)
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Database Error", f"An error occurred: {e}")
+            return
+
+        today = QDate.currentDate().toJulianDay()
+        self.lots_table.setRowCount(len(lots))
+        for row_num, lot in enumerate(lots):
+            received = QDate.fromJulianDay(lot.received_day).toString(Qt.ISODate)
+            expires = QDate.fromJulianDay(lot.expiry_day).toString(Qt.ISODate)
+            values = [str(lot.id), lot.ingredient_name, received, expires, f"{lot.quantity_remaining:g}"]
+            for col, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if lot.expiry_day < today:
+                    item.setBackground(Qt.red)  # Already expired
+                self.lots_table.setItem(row_num, col, item)
+
     def closeEvent(self, event):
-        self.db_connection.close()
+        self.change_timer.stop()
+        self.db.close()
         event.accept()
 
 def main():
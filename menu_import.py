@@ -0,0 +1,133 @@
+"""Bulk import of recipes (a whole menu) from JSON or CSV.
+
+JSON: a list of recipes (or {"recipes": [...]}):
+
+    [{"name": "Pizza", "description": "Italian food",
+      "ingredients": [{"ingredient": "Mushrooms", "quantity": 0.5}]}]
+
+CSV: one row per recipe ingredient, with a header row:
+
+    recipe,description,ingredient,quantity
+    Pizza,Italian food,Mushrooms,0.5
+
+Ingredients are matched by name and must already exist. Recipes are matched
+by name: existing ones are updated, new ones created, all in one transaction.
+
+    python menu_import.py menu.json
+"""
+import argparse
+import csv
+import json
+import math
+import os
+
+import db_setup
+from food_db import FoodDatabase
+
+
+def read_menu_file(path):
+    """Parses a JSON or CSV menu file into [(name, description, [(ingredient_name, quantity), ...])]."""
+    if os.path.splitext(path)[1].lower() == ".csv":
+        return _read_csv(path)
+    return _read_json(path)
+
+
+def _text(value, what):
+    """Returns value stripped; raises ValueError unless it is a string."""
+    if not isinstance(value, str):
+        raise ValueError(f"{what} must be text, got {value!r}.")
+    return value.strip()
+
+
+def _quantity(value, what):
+    """Returns value as a float; raises ValueError for anything that isn't a finite number."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{what} must be a number, got {value!r}.")
+    try:
+        quantity = float(value)
+    except ValueError:
+        raise ValueError(f"{what} must be a number, got {value!r}.") from None
+    if not math.isfinite(quantity):  # float() accepts "nan" and "inf"
+        raise ValueError(f"{what} must be a finite number, got {value!r}.")
+    return quantity
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("recipes", [])
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of recipes.")
+    recipes = []
+    for entry in data:
+        if not isinstance(entry, dict):
+            raise ValueError(f"Each recipe must be an object, got {entry!r}.")
+        name = _text(entry.get("name"), "Recipe name")
+        description = entry.get("description") or ""
+        lines = entry.get("ingredients", [])
+        if not isinstance(description, str) or not isinstance(lines, list):
+            raise ValueError(f"Recipe {name!r}: description must be text and ingredients a list.")
+        parsed = []
+        for line in lines:
+            if not isinstance(line, dict):
+                raise ValueError(f"Recipe {name!r}: each ingredient must be an object, got {line!r}.")
+            parsed.append((_text(line.get("ingredient"), f"Recipe {name!r}: ingredient name"),
+                           _quantity(line.get("quantity"), f"Recipe {name!r}: quantity")))
+        recipes.append((name, description, parsed))
+    return recipes
+
+
+def _read_csv(path):
+    recipes = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        # Row numbers count the header as line 1
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            name = _text(row.get("recipe"), f"Line {line_number}: recipe")
+            description, lines = recipes.setdefault(name, (row.get("description") or "", []))
+            if row.get("ingredient"):
+                lines.append((_text(row["ingredient"], f"Line {line_number}: ingredient"),
+                              _quantity(row.get("quantity"), f"Line {line_number}: quantity")))
+    return [(name, description, lines) for name, (description, lines) in recipes.items()]
+
+
+def import_menu(db, recipes):
+    """Upserts parsed recipes; returns {name: recipe_id}.
+
+    Raises ValueError if a recipe is empty or names an unknown ingredient,
+    before anything is written.
+    """
+    ingredient_ids = {name: ingredient_id for ingredient_id, name in db.ingredients.names()}
+    resolved = []
+    unknown = set()
+    for name, description, lines in recipes:
+        if not name or not lines:
+            raise ValueError(f"Recipe {name!r} needs a name and at least one ingredient.")
+        quantities = {}
+        for ingredient_name, quantity in lines:
+            if ingredient_name not in ingredient_ids:
+                unknown.add(ingredient_name)
+            elif quantity <= 0:
+                raise ValueError(f"Recipe {name!r}: quantity of {ingredient_name!r} must be positive.")
+            else:
+                quantities[ingredient_ids[ingredient_name]] = quantity
+        resolved.append((name, description, list(quantities.items())))
+    if unknown:
+        raise ValueError("Unknown ingredients: " + ", ".join(sorted(unknown)))
+    return db.recipes.upsert_many(resolved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import recipes from a JSON or CSV menu file.")
+    parser.add_argument("path", help="menu file (.json or .csv)")
+    parser.add_argument("--db", default=db_setup.DB_PATH)
+    args = parser.parse_args()
+
+    db = FoodDatabase(args.db)
+    recipe_ids = import_menu(db, read_menu_file(args.path))
+    db.close()
+    print(f"Imported {len(recipe_ids)} recipes into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Demand-aware pricing from the prices sales were actually made at.
+
+Each recipe's daily demand is modelled with a constant price elasticity,
+q = A * p**e, which is a straight line in logs: log q = log A + e * log p.
+Observations are (average selling price, units sold) per recipe and day.
+All recipes are fitted in one pass: np.bincount over the recipe of every
+observation gives each recipe's sums, and the least-squares slope and
+intercept of every recipe follow from those with array arithmetic, without a
+Python loop over the observations.
+
+With unit cost c, profit (p - c) * A * p**e is highest at
+
+    p* = c * e / (1 + e)
+
+when demand is elastic (e < -1). With inelastic demand (e >= -1) profit
+keeps rising with price, which the data can't support indefinitely, so
+suggestions are kept within the range of prices actually charged.
+"""
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+
+from catalog import positions
+
+# Sales older than this aren't used, so the fit follows changes in taste
+PRICING_WINDOW_DAYS = 730
+# A recipe needs this many days with priced sales to be fitted...
+MIN_OBSERVATIONS = 14
+# ...and prices that vary by at least about this much (std. dev. of log price)
+MIN_LOG_PRICE_STD = 0.02
+
+DemandCurve = namedtuple("DemandCurve", "elasticity log_scale observations min_price max_price")
+
+
+def fit_demand_curves(groups, prices, quantities, group_count):
+    """Fits log q = log_scale + elasticity * log p for every group at once.
+
+    groups[k] (0 .. group_count - 1) is the recipe of observation k. Returns
+    arrays (elasticity, log_scale, observations, min_price, max_price) with
+    one entry per group; elasticity and log_scale are NaN for groups with too
+    few observations or too little price variation to fit.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    prices = np.asarray(prices, dtype=float)
+    x = np.log(prices)
+    y = np.log(np.asarray(quantities, dtype=float))
+
+    counts = np.bincount(groups, minlength=group_count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = np.bincount(groups, weights=x, minlength=group_count) / counts
+        mean_y = np.bincount(groups, weights=y, minlength=group_count) / counts
+        # Centred sums, so nearly constant prices don't lose precision
+        dx = x - mean_x[groups]
+        var_x = np.bincount(groups, weights=dx * dx, minlength=group_count) / counts
+        cov_xy = np.bincount(groups, weights=dx * (y - mean_y[groups]), minlength=group_count) / counts
+        elasticity = cov_xy / var_x
+    fitted = (counts >= MIN_OBSERVATIONS) & (var_x >= MIN_LOG_PRICE_STD ** 2)
+    elasticity = np.where(fitted, elasticity, np.nan)
+    log_scale = mean_y - elasticity * mean_x
+
+    min_price = np.full(group_count, np.inf)
+    np.minimum.at(min_price, groups, prices)
+    max_price = np.zeros(group_count)
+    np.maximum.at(max_price, groups, prices)
+    return elasticity, log_scale, counts, min_price, max_price
+
+
+def fit_recipes(db, recipe_ids, start_day):
+    """Returns {recipe_id: DemandCurve} fitted on priced, unflagged sales since start_day."""
+    recipe_ids = list(recipe_ids)
+    observations = db.sales.price_observations(recipe_ids, start_day)
+    rows = np.fromiter(chain.from_iterable(observations), float, 3 * len(observations)).reshape(-1, 3)
+    groups = positions(np.array(recipe_ids, dtype=np.int64), rows[:, 0].astype(np.int64))
+    elasticity, log_scale, counts, min_price, max_price = fit_demand_curves(
+        groups, rows[:, 2], rows[:, 1], len(recipe_ids))
+    return {recipe_id: DemandCurve(float(elasticity[i]), float(log_scale[i]), int(counts[i]),
+                                   float(min_price[i]), float(max_price[i]))
+            for i, recipe_id in enumerate(recipe_ids)}
+
+
+def profit_maximizing_prices(costs, elasticity, min_price, max_price):
+    """Returns the profit-maximizing price for each recipe under its fitted curve.
+
+    Elastic demand gives c * e / (1 + e); inelastic demand gives the highest
+    price charged so far. Either way the result is kept within the observed
+    price range. NaN where there is no fitted curve.
+    """
+    costs, elasticity = np.asarray(costs, dtype=float), np.asarray(elasticity, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        best = np.where(elasticity < -1, costs * elasticity / (1 + elasticity), max_price)
+    return np.where(np.isnan(elasticity), np.nan, np.clip(best, min_price, max_price))
@@ -0,0 +1,99 @@
+"""Dynamic reorder points computed from actual ingredient consumption."""
+from statistics import NormalDist
+
+import numpy as np
+
+from catalog import positions
+
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_LEAD_TIME_DAYS = 3
+DEFAULT_SERVICE_LEVEL = 0.95
+
+
+class ReorderPlanner:
+    """Tracks daily consumption per ingredient and derives reorder points from it.
+
+    Consumption is sales x RecipeIngredients. For the last window_days days
+    (days without sales count as zero) the planner keeps a (ingredient x day)
+    consumption matrix and, per ingredient, the sum and sum of squares of
+    daily consumption, all as arrays aligned with the catalog's ingredient
+    positions. A rebuild fills them from one aggregate query, a new sale only
+    touches the ingredients of its recipe, and every reorder point comes from
+    one array expression. The reorder point covers expected use during the
+    lead time plus safety stock for the chosen service level:
+
+        reorder point = mean * lead_time + z * std_dev * sqrt(lead_time)
+    """
+
+    def __init__(self, window_days=DEFAULT_WINDOW_DAYS, lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+                 service_level=DEFAULT_SERVICE_LEVEL):
+        self.window_days = window_days
+        self.lead_time_days = lead_time_days
+        self.service_level = service_level
+        self.today = None
+        self.ingredient_ids = None  # The catalog's ingredient_ids at the last rebuild
+        self.ingredient_index = {}
+        self.daily = np.zeros((0, window_days))  # [ingredient position, day - first_day]
+        self.sums = np.zeros(0)
+        self.sums_of_squares = np.zeros(0)
+        self.stale = True
+
+    @property
+    def first_day(self):
+        return self.today - self.window_days + 1
+
+    def invalidate(self):
+        """Marks the statistics for a full rebuild, e.g. after recipes changed."""
+        self.stale = True
+
+    def rebuild(self, db, today):
+        """Recomputes daily consumption for every ingredient with one aggregate query."""
+        catalog = db.catalog
+        self.today = today
+        self.ingredient_ids = catalog.ingredient_ids
+        self.ingredient_index = catalog.ingredient_index
+        rows = np.array(db.sales.daily_ingredient_consumption(self.first_day, today).fetchall(),
+                        dtype=float).reshape(-1, 3)
+        at = positions(self.ingredient_ids, rows[:, 0].astype(np.int64))
+        known = at >= 0  # Sales of ingredients the catalog doesn't have yet are left out
+        at, days, consumed = at[known], rows[known, 1].astype(np.int64) - self.first_day, rows[known, 2]
+        self.daily = np.zeros((len(self.ingredient_ids), self.window_days))
+        np.add.at(self.daily, (at, days), consumed)
+        self.sums = self.daily.sum(axis=1)
+        self.sums_of_squares = np.square(self.daily).sum(axis=1)
+        self.stale = False
+
+    def ensure_current(self, db, today):
+        """Rebuilds if invalidated, if the window has moved to a new day or if
+        ingredients were added or removed (the catalog then has new arrays)."""
+        if self.stale or self.today != today or self.ingredient_ids is not db.catalog.ingredient_ids:
+            self.rebuild(db, today)
+
+    def record_consumption(self, day, amounts):
+        """Adds a sale's ingredient usage ({ingredient_id: amount}) on `day` to the statistics."""
+        if self.stale or not self.first_day <= day <= self.today:
+            return  # Outside the window (or a rebuild is pending anyway)
+        if any(ingredient_id not in self.ingredient_index for ingredient_id in amounts):
+            self.stale = True  # An ingredient newer than the arrays; rebuild instead
+            return
+        at = np.fromiter((self.ingredient_index[ingredient_id] for ingredient_id in amounts), np.int64, len(amounts))
+        column = day - self.first_day
+        old = self.daily[at, column]
+        new = old + np.fromiter(amounts.values(), float, len(amounts))
+        self.daily[at, column] = new
+        self.sums[at] += new - old
+        self.sums_of_squares[at] += new * new - old * old
+
+    def daily_means_and_variances(self):
+        """Returns (means, variances) of daily consumption in the catalog's ingredient order."""
+        means = self.sums / self.window_days
+        variances = self.sums_of_squares / self.window_days - means * means
+        return means, np.maximum(variances, 0.0)
+
+    def reorder_points(self):
+        """Returns the reorder point of every ingredient, aligned with the
+        catalog's ingredient positions; ingredients with no recent use get 0."""
+        means, variances = self.daily_means_and_variances()
+        z = NormalDist().inv_cdf(self.service_level)
+        lead_time = self.lead_time_days
+        return np.round(means * lead_time + z * np.sqrt(variances * lead_time), 2)
@@ -0,0 +1,98 @@
+"""LRU cache for computed results such as demand predictions and fitted demand curves."""
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class ResultCache:
+    """Caches results keyed on their inputs and the versions of the tables they read.
+
+    Each entry also carries tags such as ("sales", 3) naming the rows it was
+    computed from (here, recipe 3's sales). The app's own writes call
+    invalidate() with the tags they touched, which drops exactly the affected
+    entries. Changes made by other instances are only known per table, so
+    invalidate_tables() bumps the table version and drops everything that
+    read it. Least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (value, tags, tables)
+        self.keys_by_tag = {}
+        self.table_versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, name, args, tables):
+        return (name, args, tuple(self.table_versions.get(table, 0) for table in tables))
+
+    def get_many(self, name, args_list, tables, compute_missing):
+        """Returns {args: value} for every args in args_list.
+
+        compute_missing(missing_args) is called once with all the args that
+        weren't cached and must return {args: (value, tags)}, so misses are
+        computed in a single batch.
+        """
+        results = {}
+        missing = []
+        for args in args_list:
+            key = self._key(name, args, tables)
+            entry = self.entries.get(key)
+            if entry is None:
+                missing.append(args)
+            else:
+                self.entries.move_to_end(key)
+                results[args] = entry[0]
+        self.hits += len(results)
+        self.misses += len(missing)
+
+        if missing:
+            for args, (value, tags) in compute_missing(missing).items():
+                self._store(self._key(name, args, tables), value, tags, tables)
+                results[args] = value
+        return results
+
+    def get(self, name, args, tables, compute):
+        """Single-entry form of get_many(); compute() returns (value, tags)."""
+        return self.get_many(name, [args], tables, lambda missing: {args: compute()})[args]
+
+    def _store(self, key, value, tags, tables):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, frozenset(tags), tuple(tables))
+        for tag in tags:
+            self.keys_by_tag.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, tags, _ = self.entries.pop(key)
+        for tag in tags:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_tag[tag]
+
+    def invalidate(self, *tags):
+        """Drops every entry computed from any of the given tags."""
+        for tag in tags:
+            for key in list(self.keys_by_tag.get(tag, ())):
+                self._remove(key)
+
+    def invalidate_tables(self, tables):
+        """Bumps the version of the given tables and drops every entry that read them."""
+        tables = set(tables)
+        for table in tables:
+            self.table_versions[table] = self.table_versions.get(table, 0) + 1
+        for key, (_, _, entry_tables) in list(self.entries.items()):
+            if tables.intersection(entry_tables):
+                self._remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_tag.clear()
+
+    def stats(self):
+        """Returns (hits, misses, current number of entries)."""
+        return self.hits, self.misses, len(self.entries)
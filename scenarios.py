@@ -0,0 +1,80 @@
+"""What-if cost scenarios for ingredient price changes, evaluated with NumPy.
+
+Recipe lines are kept in the Catalog's CSR layout (see catalog.py) rather
+than as a dense (recipes x ingredients) matrix, which at tens of thousands of
+recipes and ingredients would take gigabytes. Stacking one price vector per
+scenario as the columns of a matrix gives every line's cost under every
+scenario in one gather-and-multiply, and np.add.reduceat sums the lines of
+each recipe, without touching the database.
+"""
+import numpy as np
+
+# Line costs are computed for this many scenarios at a time, which bounds the
+# (lines x scenarios) temporary when many scenarios run at once
+SCENARIO_BLOCK = 64
+
+
+class CostModel:
+    """Snapshot of recipe lines and ingredient prices for scenario evaluation."""
+
+    def __init__(self, recipe_ids, ingredient_ids, line_offsets, line_ingredients, line_quantities, prices):
+        """Lines are CSR-style as in Catalog: the recipe at position r uses the
+        ingredient positions line_ingredients[line_offsets[r]:line_offsets[r + 1]]."""
+        self.recipe_ids = list(recipe_ids)
+        self.ingredient_ids = list(ingredient_ids)
+        self.recipe_index = {recipe_id: i for i, recipe_id in enumerate(self.recipe_ids)}
+        self.ingredient_index = {ingredient_id: i for i, ingredient_id in enumerate(self.ingredient_ids)}
+        # Copies, so later catalog patches and price edits don't leak in
+        self.line_offsets = np.array(line_offsets, dtype=np.int64)
+        self.line_ingredients = np.array(line_ingredients, dtype=np.int64)
+        self.line_quantities = np.array(line_quantities, dtype=float)
+        self.prices = np.array(prices, dtype=float)
+
+    @classmethod
+    def from_db(cls, db):
+        """Builds the model from the database's shared Catalog snapshot."""
+        catalog = db.catalog
+        return cls(catalog.recipe_ids.tolist(), catalog.ingredient_ids.tolist(), catalog.line_offsets,
+                   catalog.line_ingredients, catalog.line_quantities, catalog.costs)
+
+    def _recipe_totals(self, line_values):
+        """Sums per-line values (one row per line) over each recipe's lines; recipes without lines get 0."""
+        totals = np.zeros((len(self.recipe_ids),) + line_values.shape[1:])
+        starts = self.line_offsets[:-1]
+        # reduceat can't express an empty segment, so only recipes with lines take part
+        has_lines = self.line_offsets[1:] > starts
+        if has_lines.any():
+            totals[has_lines] = np.add.reduceat(line_values, starts[has_lines], axis=0)
+        return totals
+
+    def price_matrix(self, scenarios):
+        """Builds an (ingredients x scenarios) price matrix.
+
+        Each scenario is {ingredient_id: multiplier}, e.g. {flour_id: 1.15}
+        for flour +15%; unlisted ingredients keep their current price.
+        """
+        multipliers = np.ones((len(self.ingredient_ids), len(scenarios)))
+        for col, shocks in enumerate(scenarios):
+            for ingredient_id, multiplier in shocks.items():
+                row = self.ingredient_index.get(ingredient_id)
+                if row is not None:
+                    multipliers[row, col] = multiplier
+        return self.prices[:, None] * multipliers
+
+    def base_costs(self):
+        """Current cost of every recipe, in recipe_ids order."""
+        return self._recipe_totals(self.line_quantities * self.prices[self.line_ingredients])
+
+    def scenario_costs(self, scenarios):
+        """Returns a (recipes x scenarios) matrix of recipe costs."""
+        prices = self.price_matrix(scenarios)
+        costs = np.zeros((len(self.recipe_ids), len(scenarios)))
+        for start in range(0, len(scenarios), SCENARIO_BLOCK):
+            block = prices[self.line_ingredients, start:start + SCENARIO_BLOCK]
+            costs[:, start:start + SCENARIO_BLOCK] = self._recipe_totals(self.line_quantities[:, None] * block)
+        return costs
+
+    def suggested_prices(self, scenarios, profit_margin):
+        """Suggested prices (cost x (1 + margin), rounded like the app) under each scenario."""
+        costs = np.round(self.scenario_costs(scenarios), 2)  # Same rounding as calculate_recipe_cost
+        return np.round(costs * (1 + profit_margin), 2)
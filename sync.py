@@ -0,0 +1,467 @@
+"""File-based replication of several locations into one central database.
+
+Each site keeps its own food_business.db. Triggers record every changed row
+in RowChanges under a change sequence number (see
+db_setup.migrate_locations), so a site can export only the rows changed
+since its last export:
+
+    python sync.py name "North Kitchen"        # once per site
+    python sync.py export outbox/
+
+This writes a gzipped JSON changeset such as
+outbox/North_Kitchen-000001.changeset.json.gz. Copy the files to the
+central machine any way you like and apply them there in bulk, then run the
+consolidated reports on the central copy:
+
+    python sync.py apply inbox/*.changeset.json.gz --db central.db
+    python sync.py report --days 30 --db central.db
+
+Conflict rules when applying:
+  * Sales are only ever added by the site that made them, so they never
+    conflict, and applying a changeset twice is harmless.
+  * Stock belongs to its location. Every changeset carries the location's
+    whole stock, which replaces what the central copy had for it.
+  * Catalog rows (ingredients, recipes, recipe lines) can be edited
+    anywhere. The most recent edit wins, and the central copy wins a tie.
+    Ingredients and recipes are matched by uid, which is the same at every
+    site, so a rename updates the name and keeps the row's recipe lines
+    and sales.
+  * An ingredient or recipe added at a site under a name the central copy
+    already has (two sites both added "Salt") is merged into the central
+    row: its uid is recorded as an alias of that row (UidAliases), and
+    everything the site sends for it applies to the central row.
+  * A rename to a name that a different row already has is skipped, and
+    reported; the rest of the changeset is applied.
+Changesets from one location are numbered and must be applied in order; a
+gap raises ValueError. So do sales of a recipe the central copy doesn't
+have; nothing of that changeset is applied then. Inventory lots stay local
+to each site.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+
+import db_setup
+from food_db import FoodDatabase
+
+CHANGESET_FORMAT = 2
+CHANGESET_SUFFIX = ".changeset.json.gz"
+
+# Streams whose rows can be edited at any location and are merged by edit time
+CATALOG_STREAMS = ("Ingredients", "Recipes", "RecipeIngredients")
+
+# stream -> query for rows changed after change sequence number :seq (and
+# sales after sale id :sale_id), as (changed_at, row still exists, *key,
+# *values); see KEY_LENGTHS
+EXPORT_QUERIES = {
+    "Ingredients": """
+        SELECT c.changed_at, i.id IS NOT NULL, json_extract(c.row_key, '$[0]'),
+               i.name, i.unit, i.cost_per_unit, i.threshold
+        FROM RowChanges c
+        LEFT JOIN Ingredients i ON i.uid = json_extract(c.row_key, '$[0]')
+        WHERE c.stream = 'Ingredients' AND c.seq > :seq
+    """,
+    "Recipes": """
+        SELECT c.changed_at, r.id IS NOT NULL, json_extract(c.row_key, '$[0]'), r.name, r.description
+        FROM RowChanges c
+        LEFT JOIN Recipes r ON r.uid = json_extract(c.row_key, '$[0]')
+        WHERE c.stream = 'Recipes' AND c.seq > :seq
+    """,
+    "RecipeIngredients": """
+        SELECT c.changed_at, ri.id IS NOT NULL, json_extract(c.row_key, '$[0]'), json_extract(c.row_key, '$[1]'),
+               ri.quantity_required
+        FROM RowChanges c
+        LEFT JOIN Recipes r ON r.uid = json_extract(c.row_key, '$[0]')
+        LEFT JOIN Ingredients i ON i.uid = json_extract(c.row_key, '$[1]')
+        LEFT JOIN RecipeIngredients ri ON ri.recipe_id = r.id AND ri.ingredient_id = i.id
+        WHERE c.stream = 'RecipeIngredients' AND c.seq > :seq
+    """,
+    # Sales are keyed by (day, id) in the changeset and the recipe goes by
+    # uid, taken from RecipeTombstones if the recipe has been deleted since.
+    # New sales are found by id (a scan, but no work per recorded sale);
+    # edited older ones through RowChanges.
+    "SalesHistory": f"""
+        SELECT NULL, 1, s.sale_day, s.id, IFNULL(r.uid, t.uid), s.quantity_sold, s.flagged, s.unit_price
+        FROM SalesHistory s
+        LEFT JOIN Recipes r ON r.id = s.recipe_id
+        LEFT JOIN RecipeTombstones t ON t.id = s.recipe_id
+        WHERE s.location_id = {db_setup.LOCAL_LOCATION_ID} AND s.id > :sale_id
+            AND IFNULL(r.uid, t.uid) IS NOT NULL
+        UNION
+        SELECT NULL, 1, s.sale_day, s.id, IFNULL(r.uid, t.uid), s.quantity_sold, s.flagged, s.unit_price
+        FROM RowChanges c
+        JOIN SalesHistory s ON s.recipe_id = json_extract(c.row_key, '$[0]')
+            AND s.sale_day = json_extract(c.row_key, '$[1]')
+            AND s.location_id = {db_setup.LOCAL_LOCATION_ID}
+            AND s.id = json_extract(c.row_key, '$[2]')
+        LEFT JOIN Recipes r ON r.id = s.recipe_id
+        LEFT JOIN RecipeTombstones t ON t.id = s.recipe_id
+        WHERE c.stream = 'SalesHistory' AND c.seq > :seq AND IFNULL(r.uid, t.uid) IS NOT NULL
+    """,
+}
+
+# Number of leading key fields in each stream's changeset rows. Catalog rows
+# also end with their edit time (a julian day).
+KEY_LENGTHS = {"Ingredients": 1, "Recipes": 1, "RecipeIngredients": 2, "SalesHistory": 2}
+
+# Id of the recipe whose uid is the third field of sales row j, or of the
+# latest deleted one with that uid; NULL if there is neither
+RECIPE_ID_SQL = """IFNULL(
+    (SELECT id FROM Recipes WHERE uid = json_extract(j.value, '$[2]')),
+    (SELECT MAX(id) FROM RecipeTombstones WHERE uid = json_extract(j.value, '$[2]')))"""
+
+# (stream, "rows" or "deleted", statements) in the order they are applied
+# on the central database. Every statement takes the rows as :rows (a JSON
+# array of changeset rows) and the sending location as :location.
+# Deletions come first, so a row deleted and then re-added under the same
+# name at a site doesn't clash with its old self.
+APPLY_STEPS = [
+    # Same steps as RecipeStore.delete() and IngredientStore.delete()
+    ("Recipes", "deleted", [f"""
+        DELETE FROM {table} WHERE {column} IN (
+            SELECT r.id FROM json_each(:rows) j JOIN Recipes r ON r.uid = json_extract(j.value, '$[0]')
+        )
+    """ for table, column in (("RecipeIngredients", "recipe_id"), ("SaleStats", "recipe_id"), ("Recipes", "id"))]),
+    ("Ingredients", "deleted", [f"""
+        DELETE FROM {table} WHERE {column} IN (
+            SELECT i.id FROM json_each(:rows) j JOIN Ingredients i ON i.uid = json_extract(j.value, '$[0]')
+        )
+    """ for table, column in (("InventoryLots", "ingredient_id"), ("LocationStock", "ingredient_id"),
+                              ("Ingredients", "id"))]),
+    ("Ingredients", "rows", ["""
+        INSERT INTO Ingredients (uid, name, quantity, unit, cost_per_unit, threshold)
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), 0, json_extract(value, '$[2]'),
+               json_extract(value, '$[3]'), json_extract(value, '$[4]')
+        FROM json_each(:rows) WHERE true
+        ON CONFLICT(uid) DO UPDATE SET
+            name = excluded.name, unit = excluded.unit, cost_per_unit = excluded.cost_per_unit,
+            threshold = excluded.threshold, version = version + 1
+    """]),
+    ("Recipes", "rows", ["""
+        INSERT INTO Recipes (uid, name, description)
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+        FROM json_each(:rows) WHERE true
+        ON CONFLICT(uid) DO UPDATE SET
+            name = excluded.name, description = excluded.description, version = version + 1
+    """]),
+    ("RecipeIngredients", "deleted", ["""
+        DELETE FROM RecipeIngredients WHERE id IN (
+            SELECT ri.id FROM json_each(:rows) j
+            JOIN Recipes r ON r.uid = json_extract(j.value, '$[0]')
+            JOIN Ingredients i ON i.uid = json_extract(j.value, '$[1]')
+            JOIN RecipeIngredients ri ON ri.recipe_id = r.id AND ri.ingredient_id = i.id
+        )
+    """]),
+    ("RecipeIngredients", "rows", ["""
+        INSERT INTO RecipeIngredients (recipe_id, ingredient_id, quantity_required)
+        SELECT r.id, i.id, json_extract(j.value, '$[2]') FROM json_each(:rows) j
+        JOIN Recipes r ON r.uid = json_extract(j.value, '$[0]')
+        JOIN Ingredients i ON i.uid = json_extract(j.value, '$[1]')
+        WHERE true
+        ON CONFLICT(recipe_id, ingredient_id) DO UPDATE SET quantity_required = excluded.quantity_required
+    """]),
+    ("Stock", "rows", ["DELETE FROM LocationStock WHERE location_id = :location", """
+        INSERT INTO LocationStock (location_id, ingredient_id, quantity)
+        SELECT :location, i.id, json_extract(j.value, '$[1]') FROM json_each(:rows) j
+        JOIN Ingredients i ON i.uid = json_extract(j.value, '$[0]')
+    """]),
+    # A sale of a deleted recipe keeps that recipe's id, found through RecipeTombstones
+    ("SalesHistory", "rows", [f"""
+        WITH sales (value, recipe_id) AS (
+            SELECT j.value, {RECIPE_ID_SQL} FROM json_each(:rows) j
+        )
+        INSERT INTO SalesHistory (recipe_id, sale_day, location_id, id, quantity_sold, flagged, unit_price)
+        SELECT recipe_id, json_extract(value, '$[0]'), :location, json_extract(value, '$[1]'),
+               json_extract(value, '$[3]'), json_extract(value, '$[4]'), json_extract(value, '$[5]')
+        FROM sales
+        WHERE recipe_id IS NOT NULL
+        ON CONFLICT(recipe_id, sale_day, location_id, id) DO UPDATE SET
+            quantity_sold = excluded.quantity_sold, flagged = excluded.flagged
+    """]),
+]
+
+# stream -> (query for the rows in :rows that its "rows" step can't apply,
+# what is wrong with them). Run just before that step; any result makes
+# apply_changeset() raise ValueError instead of dropping the rows.
+APPLY_CHECKS = {
+    "SalesHistory": (f"""
+        SELECT DISTINCT json_extract(j.value, '$[2]') FROM json_each(:rows) j
+        WHERE {RECIPE_ID_SQL} IS NULL
+    """, "sales of recipes this database doesn't have (by uid)"),
+}
+
+
+# Tables whose rows are merged by name when two sites add the same one -> what a row is called
+NAMED_TABLES = {"Ingredients": "ingredient", "Recipes": "recipe"}
+
+# stream -> (table, position) of each ingredient or recipe uid in its
+# changeset rows, which apply_changeset() maps through UidAliases
+UID_FIELDS = {
+    "Ingredients": [("Ingredients", 0)],
+    "Recipes": [("Recipes", 0)],
+    "RecipeIngredients": [("Recipes", 0), ("Ingredients", 1)],
+    "Stock": [("Ingredients", 0)],
+    "SalesHistory": [("Recipes", 2)],
+}
+
+# Uids in :rows (the rows) and :deleted (the deletions) of a {table} stream
+CHANGESET_UIDS_SQL = """
+    SELECT json_extract(value, '$[0]') FROM json_each(:rows)
+    UNION ALL
+    SELECT json_extract(value, '$[0]') FROM json_each(:deleted)
+"""
+
+# Makes each {table} row in :rows that is new here but has the name of an
+# existing row an alias of that row. A row the same changeset renames or
+# deletes keeps its name free for the new one.
+ALIAS_SQL = f"""
+    INSERT INTO UidAliases (stream, uid, local_uid)
+    SELECT '{{table}}', json_extract(j.value, '$[0]'), t.uid FROM json_each(:rows) j
+    JOIN {{table}} t ON t.name = json_extract(j.value, '$[1]')
+    WHERE NOT EXISTS (SELECT 1 FROM {{table}} k WHERE k.uid = json_extract(j.value, '$[0]'))
+        AND t.uid NOT IN ({CHANGESET_UIDS_SQL})
+    ON CONFLICT DO NOTHING
+"""
+
+# (position in :rows, current name, new name) of the renames in a {table}
+# stream's :rows to a name a different row already has
+NAME_CLASH_SQL = f"""
+    SELECT j.key, t.name, json_extract(j.value, '$[1]') FROM json_each(:rows) j
+    JOIN {{table}} t ON t.uid = json_extract(j.value, '$[0]')
+    JOIN {{table}} o ON o.name = json_extract(j.value, '$[1]') AND o.uid <> t.uid
+    WHERE o.uid NOT IN ({CHANGESET_UIDS_SQL})
+"""
+
+
+def _key_sql(stream):
+    """SQL that rebuilds a changeset row's RowChanges key, exactly as the triggers write it."""
+    parts = ", ".join(f"json_extract(j.value, '$[{i}]')" for i in range(KEY_LENGTHS[stream]))
+    return f"json_array({parts})"
+
+
+def _position(conn):
+    """Returns (last change sequence number, last sale id, Ingredients table version)."""
+    return (conn.execute("SELECT IFNULL(MAX(seq), 0) FROM RowChanges").fetchone()[0],
+            conn.execute("SELECT value FROM Sequences WHERE name = 'SalesHistory'").fetchone()[0],
+            conn.execute("SELECT version FROM TableVersions WHERE name = 'Ingredients'").fetchone()[0])
+
+
+def export_changeset(db, directory):
+    """Writes the rows changed since the last export to a changeset file in `directory`.
+
+    Returns the file path, or None if nothing changed. Raises ValueError if
+    this location still has the default name.
+    """
+    conn = db.conn
+    conn.execute("BEGIN")  # One snapshot for the positions and every stream
+    try:
+        location = db.locations.local()
+        if location.name == db_setup.DEFAULT_LOCATION_NAME:
+            raise ValueError('Name this location first, e.g. python sync.py name "North Kitchen".')
+        to_seq, to_sale_id, stock_version = _position(conn)
+        if (to_seq, to_sale_id, stock_version) == (location.exported_seq, location.exported_sale_id,
+                                                   location.exported_stock_version):
+            conn.rollback()
+            return None
+        params = {"seq": location.exported_seq, "sale_id": location.exported_sale_id}
+
+        streams = {}
+        for stream, sql in EXPORT_QUERIES.items():
+            rows, deleted = [], []
+            key_length = KEY_LENGTHS[stream]
+            edit_time = stream in CATALOG_STREAMS
+            for changed_at, exists, *row in conn.execute(sql, params):
+                if not exists:
+                    row = row[:key_length]
+                if edit_time:
+                    row.append(changed_at)
+                (rows if exists else deleted).append(row)
+            streams[stream] = {"rows": rows, "deleted": deleted}
+        streams["Stock"] = {"rows": conn.execute("SELECT uid, quantity FROM Ingredients").fetchall(),
+                            "deleted": []}
+        changeset = {
+            "format": CHANGESET_FORMAT,
+            "location": location.name,
+            "number": location.changeset + 1,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "streams": streams,
+        }
+
+        file_name = (f"{re.sub(r'[^A-Za-z0-9-]+', '_', location.name)}"
+                     f"-{location.changeset + 1:06d}{CHANGESET_SUFFIX}")
+        path = os.path.join(directory, file_name)
+        os.makedirs(directory, exist_ok=True)
+        # One write of the whole document; json.dump() into a gzip stream is several times slower
+        with open(path, "wb") as f:
+            f.write(gzip.compress(json.dumps(changeset, separators=(",", ":")).encode("utf-8"),
+                                  compresslevel=6))
+        conn.execute("""
+            UPDATE Locations
+            SET changeset = changeset + 1, exported_seq = ?, exported_sale_id = ?, exported_stock_version = ?
+            WHERE id = ?
+        """, (to_seq, to_sale_id, stock_version, location.id))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return path
+
+
+def _map_aliases(cursor, streams):
+    """Replaces every aliased ingredient and recipe uid in the changeset streams with the uid it stands for."""
+    aliases = {table: dict(cursor.execute("SELECT uid, local_uid FROM UidAliases WHERE stream = ?", (table,)))
+               for table in NAMED_TABLES}
+    for stream, fields in UID_FIELDS.items():
+        for kind in ("rows", "deleted"):
+            for row in streams[stream][kind]:
+                for table, position in fields:
+                    row[position] = aliases[table].get(row[position], row[position])
+
+
+def read_changeset(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        changeset = json.load(f)
+    if changeset.get("format") != CHANGESET_FORMAT:
+        raise ValueError(f"{path} is not a changeset this version can read.")
+    return changeset
+
+
+def apply_changeset(db, changeset, skipped=None):
+    """Applies one changeset in a single transaction; returns False if it was already applied.
+
+    Renames that would clash with another row's name are left out, and a
+    description of each is appended to the `skipped` list if one is given.
+    Raises ValueError if an earlier changeset from the same location is
+    missing, if the changeset comes from this database's own location, or if
+    some of its rows can't be applied (see APPLY_CHECKS); nothing is applied then.
+    """
+    name = changeset["location"]
+    with db.conn as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Locations (name) VALUES (?) ON CONFLICT(name) DO NOTHING", (name,))
+        cursor.execute("SELECT id, changeset FROM Locations WHERE name = ?", (name,))
+        location_id, applied = cursor.fetchone()
+        if location_id == db_setup.LOCAL_LOCATION_ID:
+            raise ValueError(f"The changeset is from {name!r}, which is this database's own location.")
+        if changeset["number"] <= applied:
+            return False
+        if changeset["number"] > applied + 1:
+            raise ValueError(f"Changeset {applied + 1} from {name!r} hasn't been applied yet; apply it first.")
+
+        # Rows new here under a name this database already has become aliases of
+        # the existing rows, so everything else the site sends goes to those rows
+        streams = changeset["streams"]
+        _map_aliases(cursor, streams)
+        aliased = 0
+        for table in NAMED_TABLES:
+            cursor.execute(ALIAS_SQL.format(table=table), {"rows": json.dumps(streams[table]["rows"]),
+                                                           "deleted": json.dumps(streams[table]["deleted"])})
+            aliased += cursor.rowcount
+        if aliased:
+            _map_aliases(cursor, streams)
+
+        # Catalog edits only count if they are newer than the central copy's last edit
+        for stream in CATALOG_STREAMS:
+            for kind in ("rows", "deleted"):
+                cursor.execute(f"""
+                    SELECT j.value FROM json_each(?) j
+                    WHERE json_extract(j.value, '$[#-1]') > IFNULL(
+                        (SELECT changed_at FROM RowChanges WHERE stream = ? AND row_key = {_key_sql(stream)}), -1)
+                """, (json.dumps(streams[stream][kind]), stream))
+                streams[stream][kind] = [json.loads(value) for value, in cursor.fetchall()]
+
+        # Names are unique, so a rename to another row's name keeps the old name
+        for table, what in NAMED_TABLES.items():
+            rows = streams[table]["rows"]
+            cursor.execute(NAME_CLASH_SQL.format(table=table), {"rows": json.dumps(rows),
+                                                                "deleted": json.dumps(streams[table]["deleted"])})
+            clashes = cursor.fetchall()
+            for _, old_name, new_name in clashes:
+                if skipped is not None:
+                    skipped.append(f"Changeset {changeset['number']} from {name!r}: kept the {what} {old_name!r} "
+                                   f"instead of renaming it to {new_name!r}, which a different {what} here has")
+            clashing = {position for position, _, _ in clashes}
+            streams[table]["rows"] = [row for position, row in enumerate(rows) if position not in clashing]
+
+        cursor.execute("SELECT IFNULL(MAX(seq), 0) FROM RowChanges")
+        seq_before = cursor.fetchone()[0]
+        for stream, kind, statements in APPLY_STEPS:
+            params = {"rows": json.dumps(streams[stream][kind]), "location": location_id}
+            if kind == "rows" and stream in APPLY_CHECKS:
+                sql, problem = APPLY_CHECKS[stream]
+                rejected = [value for value, in cursor.execute(sql, params)]
+                if rejected:
+                    raise ValueError(f"Changeset {changeset['number']} from {name!r} has {problem}: "
+                                     f"{', '.join(map(str, rejected))}")
+            for sql in statements:
+                cursor.execute(sql, params)
+
+        # The triggers stamped the applied rows with the current time; keep
+        # the original edit times so later changesets are compared fairly
+        for stream in CATALOG_STREAMS:
+            cursor.execute(f"""
+                WITH applied (row_key, changed_at) AS MATERIALIZED (
+                    SELECT {_key_sql(stream)}, json_extract(j.value, '$[#-1]') FROM json_each(?) j
+                )
+                UPDATE RowChanges SET changed_at = applied.changed_at
+                FROM applied
+                WHERE RowChanges.stream = ? AND RowChanges.row_key = applied.row_key AND RowChanges.seq > ?
+            """, (json.dumps(streams[stream]["rows"] + streams[stream]["deleted"]), stream, seq_before))
+        cursor.execute("UPDATE Locations SET changeset = ? WHERE id = ?", (changeset["number"], location_id))
+    return True
+
+
+def apply_changesets(db, paths, skipped=None):
+    """Applies changeset files in order per location; returns how many were new.
+
+    Descriptions of the rows left out are appended to `skipped`, as in apply_changeset().
+    """
+    changesets = sorted(map(read_changeset, paths),
+                        key=lambda c: (c["location"], c["number"]))
+    return sum(apply_changeset(db, changeset, skipped) for changeset in changesets)
+
+
+def print_report(db, days):
+    start_day = db_setup.date_to_day(datetime.date.today() - datetime.timedelta(days=days))
+    print(f"Sales in the last {days} days")
+    for recipe, location, quantity in db.locations.sales(start_day):
+        print(f"  {recipe:<30} {location:<20} {quantity:12.2f}")
+    print("Stock")
+    for ingredient, unit, location, quantity in db.locations.stock():
+        print(f"  {ingredient:<30} {location:<20} {quantity:12.2f} {unit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate locations into a central database with changeset files.")
+    parser.add_argument("--db", default=db_setup.DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("name", help="name this database's location").add_argument("name")
+    commands.add_parser("export", help="write the changes since the last export").add_argument("directory")
+    commands.add_parser("apply", help="apply changeset files").add_argument("paths", nargs="+")
+    commands.add_parser("report", help="sales and stock per location").add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    db = FoodDatabase(args.db)
+    try:
+        if args.command == "name":
+            db.locations.rename_local(args.name)
+        elif args.command == "export":
+            path = export_changeset(db, args.directory)
+            print(f"Wrote {path}" if path else "No changes since the last export")
+        elif args.command == "apply":
+            skipped = []
+            applied = apply_changesets(db, args.paths, skipped)
+            for problem in skipped:
+                print(f"Skipped: {problem}")
+            print(f"Applied {applied} of {len(args.paths)} changesets")
+        else:
+            print_report(db, args.days)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""A lightweight line chart for sales trends that stays responsive on long histories."""
+from bisect import bisect_left, bisect_right
+
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QPainter, QPen, QPolygonF
+from PyQt5.QtCore import Qt, QDate, QPointF
+
+from trends import lttb
+
+MARGIN_LEFT = 70
+MARGIN_RIGHT = 50
+MARGIN_TOP = 20
+MARGIN_BOTTOM = 40
+ZOOM_STEP = 1.25
+
+
+def short_number(value):
+    """Formats axis values compactly, e.g. 1.5M or 12k."""
+    for limit, suffix in ((1e6, "M"), (1e3, "k")):
+        if abs(value) >= limit:
+            return f"{value / limit:.3g}{suffix}"
+    return f"{value:.3g}"
+
+
+class TrendChart(QWidget):
+    """Plots one series of (day number, value) points.
+
+    Only the visible part of the series is drawn, and it is first reduced
+    with LTTB to about one point per horizontal pixel. Redraw cost therefore
+    depends on the widget width, not on how many years of history are
+    loaded. Use the mouse wheel to zoom, drag to pan, and double-click to
+    show everything again.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(250)
+        self.xs = []
+        self.ys = []
+        self.label = ""
+        self.view = None  # (first_day, last_day) currently shown
+        self.drag_start = None
+        self._sampled = None  # (cache key, xs, ys)
+
+    def set_series(self, xs, ys, label):
+        self.xs = list(xs)
+        self.ys = list(ys)
+        self.label = label
+        self.reset_view()
+
+    def reset_view(self):
+        self.view = (self.xs[0], max(self.xs[-1], self.xs[0] + 1)) if self.xs else None
+        self._sampled = None
+        self.update()
+
+    def plot_rect(self):
+        return (MARGIN_LEFT, MARGIN_TOP,
+                max(1, self.width() - MARGIN_LEFT - MARGIN_RIGHT),
+                max(1, self.height() - MARGIN_TOP - MARGIN_BOTTOM))
+
+    def visible_points(self, width):
+        """Returns the LTTB-downsampled points inside the current view, cached per view and width."""
+        key = (self.view, width)
+        if self._sampled is None or self._sampled[0] != key:
+            first_day, last_day = self.view
+            # One extra point on each side so the line runs to the plot edges
+            start = max(bisect_left(self.xs, first_day) - 1, 0)
+            end = min(bisect_right(self.xs, last_day) + 1, len(self.xs))
+            xs, ys = lttb(self.xs[start:end], self.ys[start:end], max(width, 3))
+            self._sampled = (key, xs, ys)
+        return self._sampled[1], self._sampled[2]
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), Qt.white)
+        left, top, width, height = self.plot_rect()
+
+        painter.setPen(QPen(Qt.black))
+        painter.drawLine(left, top + height, left + width, top + height)
+        painter.drawLine(left, top, left, top + height)
+
+        if not self.xs:
+            painter.drawText(self.rect(), Qt.AlignCenter, "No sales in this period")
+            return
+
+        xs, ys = self.visible_points(width)
+        first_day, last_day = self.view
+        y_max = max(max(ys, default=0), 1)
+
+        def to_point(x, y):
+            return QPointF(left + (x - first_day) / (last_day - first_day) * width,
+                           top + height - y / y_max * height)
+
+        # Axis labels: value scale on the left, dates along the bottom
+        for i in range(5):
+            value = y_max * i / 4
+            y = top + height - height * i / 4
+            painter.drawText(0, int(y) - 8, MARGIN_LEFT - 6, 16, Qt.AlignRight | Qt.AlignVCenter, short_number(value))
+        for i in range(5):
+            day = first_day + (last_day - first_day) * i / 4
+            x = left + width * i / 4
+            date_text = QDate.fromJulianDay(int(round(day))).toString(Qt.ISODate)
+            painter.drawText(int(x) - 45, top + height + 6, 90, 16, Qt.AlignHCenter, date_text)
+        painter.drawText(left + 6, top, width, 16, Qt.AlignLeft, self.label)
+
+        painter.setClipRect(left, top, width + 1, height + 1)
+        painter.setPen(QPen(Qt.blue, 1.5))
+        painter.drawPolyline(QPolygonF([to_point(x, y) for x, y in zip(xs, ys)]))
+
+    def wheelEvent(self, event):
+        if self.view is None:
+            return
+        left, _, width, _ = self.plot_rect()
+        first_day, last_day = self.view
+        span = last_day - first_day
+        # Zoom around the day under the cursor
+        anchor = first_day + min(max((event.x() - left) / width, 0), 1) * span
+        factor = 1 / ZOOM_STEP if event.angleDelta().y() > 0 else ZOOM_STEP
+        new_span = min(max(span * factor, 7), self.xs[-1] - self.xs[0] + 1)
+        new_first = anchor - (anchor - first_day) * new_span / span
+        self.view = (new_first, new_first + new_span)
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.view is not None:
+            self.drag_start = (event.x(), self.view)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is None:
+            return
+        start_x, (first_day, last_day) = self.drag_start
+        _, _, width, _ = self.plot_rect()
+        shift = (start_x - event.x()) / width * (last_day - first_day)
+        self.view = (first_day + shift, last_day + shift)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset_view()
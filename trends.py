@@ -0,0 +1,63 @@
+"""Sales trend series and largest-triangle-three-buckets (LTTB) downsampling."""
+
+BUCKETS = ("day", "week", "month")
+
+
+def build_series(rows, prices):
+    """Sums per-recipe bucket rows into (bucket_days, units, revenue) lists ordered by bucket.
+
+    rows are (bucket_start_day, recipe_id, units, unpriced units, revenue) as
+    returned by SalesStore.trend(). Revenue is what sales were recorded at;
+    sales made before prices were recorded are valued at prices[recipe_id]
+    (0 if unknown) instead.
+    """
+    units = {}
+    revenue = {}
+    for bucket_day, recipe_id, sold, unpriced, sold_for in rows:
+        units[bucket_day] = units.get(bucket_day, 0) + sold
+        revenue[bucket_day] = revenue.get(bucket_day, 0) + sold_for + unpriced * prices.get(recipe_id, 0)
+    days = sorted(units)
+    return days, [units[day] for day in days], [round(revenue[day], 2) for day in days]
+
+
+def lttb(xs, ys, threshold):
+    """Downsamples a series to at most `threshold` points, keeping its visual shape.
+
+    The first and last points are always kept. The points in between are
+    split into threshold - 2 buckets. From each bucket, LTTB keeps the point
+    that makes the largest triangle with the previously kept point and with
+    the average of the next bucket, which preserves peaks and dips.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+
+    every = (n - 2) / (threshold - 2)
+    sampled_x = [xs[0]]
+    sampled_y = [ys[0]]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_count = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_count
+        avg_y = sum(ys[avg_start:avg_end]) / avg_count
+
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        sampled_x.append(xs[next_a])
+        sampled_y.append(ys[next_a])
+        a = next_a
+
+    sampled_x.append(xs[-1])
+    sampled_y.append(ys[-1])
+    return sampled_x, sampled_y